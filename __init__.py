@@ -1,3 +1,4 @@
+import argparse
 import errno
 import sys
 
@@ -10,9 +11,18 @@ def initApp() -> bot:
     Initialize Matrix bot
     """
 
+    # Parse command line arguments
+    parser = argparse.ArgumentParser(description='Spacebot')
+    parser.add_argument(
+        '--full-sync',
+        action='store_true',
+        help='ignore cached sync token and request full room state'
+    )
+    arguments = parser.parse_args()
+
     # Initialize bot
     try:
-        matrixBot = bot()
+        matrixBot = bot(fullSync=arguments.full_sync)
     except LookupError:
         sys.exit(errno.EINTR)
 
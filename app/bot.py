@@ -1,5 +1,7 @@
 import asyncio
 import datetime
+import functools
+import hashlib
 import json
 import nio
 import os
@@ -7,8 +9,15 @@ import safer
 import sys
 
 from app import VERSION
+from app.commandDispatcher import commandDispatcher
 from app.config import config
+from app.executor import executor
+from app.httpClient import httpClient
+from app.joinedRooms import joinedRooms
+from app.messageQueue import messageQueue
 from app.pluginCollection import pluginCollection
+from app.scheduler import scheduler
+from app.stateStore import stateStore
 
 
 class bot:
@@ -31,11 +40,28 @@ class bot:
     # Event loop
     __loop = None
 
-    def __init__(self):
+    # Background task for plugin startup
+    __pluginStartup = None
+
+    # Latest sync token and sync token written to sync cache
+    __syncToken = None
+    __syncTokenSaved = None
+
+    # Scheduled write of sync token, its task and delay in seconds
+    __syncTokenHandle = None
+    __syncTokenTask = None
+    __syncTokenDelay = 5
+
+    def __init__(self, fullSync: bool = False):
         """
         Constructor
 
         Start base class constructor and initiate connection
+
+        Parameters
+        ----------
+        fullSync : bool
+            Ignore cached sync token and request full state on first sync
         """
 
         # Load config
@@ -49,6 +75,19 @@ class bot:
         if 'sessioncache' not in self._config:
             self._config['sessioncache'] = 'config/cache/matrix-session'
 
+        # Set default sync token cache file
+        if 'synccache' not in self._config:
+            self._config['synccache'] = 'config/cache/matrix-sync'
+
+        # Ignore cached sync token on first sync
+        self.__fullSync = fullSync
+
+        # Initialize queue for outgoing messages
+        messageQueue(self._config.get('sendqueue', {}))
+
+        # Initialize dispatcher for incoming commands
+        commandDispatcher(self._config.get('dispatcher', {}))
+
         # Initialize matrix api instance and connect to server
         self.__loop = asyncio.get_event_loop()
         self.__loop.run_until_complete(self.__connect())
@@ -108,7 +147,10 @@ class bot:
                     % sessionCache['homeserver']
                 )
 
-                client = nio.AsyncClient(sessionCache['homeserver'])
+                client = nio.AsyncClient(
+                            sessionCache['homeserver'],
+                            config=self.__getClientConfig()
+                         )
                 client.restore_login(
                     user_id=sessionCache['user_id'],
                     device_id=sessionCache['device_id'],
@@ -116,6 +158,7 @@ class bot:
                 )
 
                 self.__matrixApi = client
+                messageQueue().setMatrixApi(client)
 
                 # Try to send welcome messages to verify cached credentials
                 if await self.__sendWelcomeMessages():
@@ -129,7 +172,8 @@ class bot:
         # Try to login
         client = nio.AsyncClient(
                     self._config['homeserver'],
-                    self._config['username']
+                    self._config['username'],
+                    config=self.__getClientConfig()
                  )
         loginResponse = await client.login(
                             self._config['password'],
@@ -144,6 +188,7 @@ class bot:
                 (loginResponse.device_id)
             )
             self.__matrixApi = client
+            messageQueue().setMatrixApi(client)
 
             with safer.open(self._config['sessioncache'], 'w') as f:
                 f.write(
@@ -173,6 +218,18 @@ class bot:
         if await self.__sendWelcomeMessages():
             return
 
+    def __getClientConfig(self) -> nio.AsyncClientConfig:
+        """Get client configuration
+
+        Rate limited requests are returned instead of retried inside nio,
+        so the message queue can pause all rooms on M_LIMIT_EXCEEDED.
+
+        Returns
+        -------
+        nio.AsyncClientConfig
+        """
+        return nio.AsyncClientConfig(max_limit_exceeded=0)
+
     async def __sendWelcomeMessages(self) -> bool:
         """Send welcome messages to all rooms
 
@@ -193,6 +250,12 @@ class bot:
             # Try to join new room and haven't joined as that user, you can use
             # Joining if already joined will also be successfull
             joinResponse = await self.__matrixApi.join(room)
+            while (isinstance(joinResponse, nio.JoinError)
+                    and joinResponse.status_code == 'M_LIMIT_EXCEEDED'):
+                await asyncio.sleep(
+                    (joinResponse.retry_after_ms or 5000) / 1000
+                )
+                joinResponse = await self.__matrixApi.join(room)
             if not isinstance(joinResponse, nio.JoinResponse):
                 # Join to channel failed
                 print(
@@ -201,13 +264,13 @@ class bot:
                     file=sys.stderr
                 )
                 return False
+            joinedRooms().add(room)
 
         # Post welcome message to all rooms
         for room in self._config['rooms']:
             # Push status message to matrix
-            messageResponse = await self.__matrixApi.room_send(
+            messageResponse = await messageQueue().send(
                 room,
-                message_type="m.room.message",
                 content={
                     "msgtype": "m.notice",
                     "body": welcomePhrase
@@ -260,6 +323,12 @@ class bot:
             self.__loop.run_until_complete(self._run())
         except KeyboardInterrupt:
             print("Received exit, exiting")
+        finally:
+            self.__loop.run_until_complete(messageQueue().close())
+            self.__loop.run_until_complete(self.__saveSyncToken())
+            self.__loop.run_until_complete(stateStore().flush())
+            self.__loop.run_until_complete(httpClient().close())
+            executor().shutdown()
 
     def getMatrixApi(self):
         return self.__matrixApi
@@ -305,88 +374,322 @@ class bot:
             except ValueError:
                 keyword, parameter = event.body[1:], None
 
-            # Version request
-            if (keyword == "version"):
+            # Handle command outside of sync callback
+            commandDispatcher().dispatch(
+                room.room_id,
+                functools.partial(
+                    self._handleCommand, room.room_id, keyword, parameter
+                )
+            )
+
+    async def _handleCommand(self, roomId: str, keyword: str, parameter: str):
+        """Run command and enqueue result for room"""
+
+        # Version request
+        if (keyword == "version"):
+
+            messageQueue().send(
+                roomId,
+                content={
+                    "msgtype": "m.text",
+                    "body": "Running version: %s" % VERSION
+                }
+            )
+
+        # Scheduled jobs request
+        elif (keyword == "jobs"):
+
+            messageQueue().send(
+                roomId,
+                content={
+                    "msgtype": "m.notice",
+                    "format": "org.matrix.custom.html",
+                    "body": "message",
+                    "formatted_body":
+                        "<pre><code>%s</code></pre>"
+                        % scheduler().report()
+                }
+            )
 
-                messageResponse = await self.__matrixApi.room_send(
-                    room.room_id,
-                    message_type="m.room.message",
+        # Help request
+        elif (keyword == "help"):
+
+            if parameter is None:
+                # No parameter, output global help
+                result = \
+                    await pluginCollection().help(
+                        self._config['controlsign'],
+                        roomId
+                    )
+            else:
+                # Parameter set, output plugin help if available
+                result = \
+                    await pluginCollection().keywordHelp(
+                        parameter,
+                        self._config['controlsign'],
+                        roomId
+                    )
+
+            # Output valid results
+            if result is not None:
+                messageQueue().send(
+                    roomId,
                     content={
-                        "msgtype": "m.text",
-                        "body": "Running version: %s" % VERSION
+                        "msgtype": "m.notice",
+                        "format": "org.matrix.custom.html",
+                        "body": "message",
+                        "formatted_body":
+                            "<pre><code>%s</code></pre>"
+                            % result
                     }
                 )
 
-            # Help request
-            elif (keyword == "help"):
-
-                if parameter is None:
-                    # No parameter, output global help
-                    result = \
-                        await pluginCollection().help(
-                            self._config['controlsign'],
-                            room.room_id
-                        )
-                else:
-                    # Parameter set, output plugin help if available
-                    result = \
-                        await pluginCollection().keywordHelp(
-                            parameter,
-                            self._config['controlsign'],
-                            room.room_id
-                        )
+        # Any other request
+        else:
+            result = \
+                await pluginCollection().keyword(
+                    keyword,
+                    parameter,
+                    roomId
+                )
 
-                # Output valid results
-                if result is not None:
-                    messageResponse = await self.__matrixApi.room_send(
-                        room.room_id,
-                        message_type="m.room.message",
+            if result is not None:
+                if pluginCollection().isOutputHtml(keyword):
+                    # Send valid result as html
+                    messageQueue().send(
+                        roomId,
                         content={
-                            "msgtype": "m.notice",
+                            "msgtype": "m.text",
                             "format": "org.matrix.custom.html",
                             "body": "message",
-                            "formatted_body":
-                                "<pre><code>%s</code></pre>"
-                                % result
+                            "formatted_body": "%s" % result
                         }
                     )
-
-            # Any other request
-            else:
-                result = \
-                    await pluginCollection().keyword(
-                        keyword,
-                        parameter,
-                        room.room_id
+                else:
+                    # Send valid result as text
+                    messageQueue().send(
+                        roomId,
+                        content={
+                            "msgtype": "m.text",
+                            "body": "%s" % result
+                        }
                     )
 
-                if result is not None:
-                    if pluginCollection().isOutputHtml(keyword):
-                        # Send valid result as html
-                        messageResponse = await self.__matrixApi.room_send(
-                            room.room_id,
-                            message_type="m.room.message",
-                            content={
-                                "msgtype": "m.text",
-                                "format": "org.matrix.custom.html",
-                                "body": "message",
-                                "formatted_body": "%s" % result
-                            }
-                        )
-                    else:
-                        # Send valid result as text
-                        messageResponse = await self.__matrixApi.room_send(
-                            room.room_id,
-                            message_type="m.room.message",
-                            content={
-                                "msgtype": "m.text",
-                                "body": "%s" % result
-                            }
-                        )
+    def __getSyncFilter(self) -> dict:
+        """Build sync filter for configured rooms and message events
+
+        Returns
+        -------
+        dict
+        """
+        filterConfig = {
+            'event_types': ['m.room.message'],
+            'timeline_limit': 10,
+            'lazy_load_members': True,
+            **self._config.get('syncfilter', {})
+        }
+
+        return {
+            'presence': {'types': []},
+            'account_data': {'types': []},
+            'room': {
+                'rooms': config().getAllRooms(),
+                'timeline': {
+                    'types': filterConfig['event_types'],
+                    'limit': filterConfig['timeline_limit'],
+                    'lazy_load_members': filterConfig['lazy_load_members'],
+                },
+                'state': {
+                    'types': [
+                        'm.room.member',
+                        'm.room.name',
+                        'm.room.canonical_alias',
+                    ],
+                    'lazy_load_members': filterConfig['lazy_load_members'],
+                },
+                'ephemeral': {'types': []},
+                'account_data': {'types': []},
+            },
+        }
+
+    async def __getSyncFilterId(self) -> str:
+        """Get id of uploaded sync filter or upload changed filter
+
+        Returns
+        -------
+        string
+            Filter id or None if upload failed
+        """
+        syncFilter = self.__getSyncFilter()
+        syncFilterHash = hashlib.sha256(
+            json.dumps(syncFilter, sort_keys=True).encode()
+        ).hexdigest()
+
+        try:
+            with open(self._config['sessioncache'], 'r') as f:
+                sessionCache = json.load(f)
+        except (OSError, ValueError):
+            sessionCache = {}
+
+        # Reuse cached filter id if filter is unchanged
+        if (sessionCache.get('user_id') == self.__matrixApi.user_id
+                and sessionCache.get('filter_hash') == syncFilterHash
+                and sessionCache.get('filter_id') is not None):
+            return sessionCache['filter_id']
+
+        filterResponse = await self.__matrixApi.upload_filter(
+            presence=syncFilter['presence'],
+            account_data=syncFilter['account_data'],
+            room=syncFilter['room']
+        )
+        if not isinstance(filterResponse, nio.UploadFilterResponse):
+            print(
+                'ERROR: Upload of sync filter failed: %s' % filterResponse,
+                file=sys.stderr
+            )
+            return None
+
+        print(
+            'MATRIX: Uploaded sync filter with id %s.'
+            % filterResponse.filter_id
+        )
+
+        # Save filter id to session cache
+        if len(sessionCache) > 0:
+            sessionCache['filter_hash'] = syncFilterHash
+            sessionCache['filter_id'] = filterResponse.filter_id
+            with safer.open(self._config['sessioncache'], 'w') as f:
+                f.write(json.dumps(sessionCache, indent=4))
+
+        return filterResponse.filter_id
+
+    def __loadSyncToken(self) -> str:
+        """Get cached sync token for current user
+
+        Returns
+        -------
+        string
+            Sync token or None if no valid token is cached
+        """
+        if self.__fullSync or not os.path.exists(self._config['synccache']):
+            return None
+
+        try:
+            with open(self._config['synccache'], 'r') as f:
+                syncCache = json.load(f)
+        except ValueError:
+            return None
+
+        if syncCache.get('user_id') != self.__matrixApi.user_id:
+            return None
+
+        self.__syncToken = self.__syncTokenSaved = syncCache.get('next_batch')
+        return self.__syncToken
+
+    async def _syncResponse(self, response: nio.SyncResponse):
+        """Update joined rooms and save sync token to resume after restart"""
+        joinedRooms().update(response)
+
+        # Write changed sync token debounced
+        self.__syncToken = response.next_batch
+        if self.__syncToken != self.__syncTokenSaved and \
+                self.__syncTokenHandle is None:
+            self.__syncTokenHandle = asyncio.get_event_loop().call_later(
+                self.__syncTokenDelay, self.__startSaveSyncToken
+            )
+
+    def __startSaveSyncToken(self):
+        """Start debounced write of sync token, keep task until done"""
+        self.__syncTokenTask = \
+            asyncio.get_event_loop().create_task(self.__saveSyncToken())
+        self.__syncTokenTask.add_done_callback(self.__saveSyncTokenDone)
+
+    def __saveSyncTokenDone(self, task: asyncio.Task):
+        """Log exception of debounced write of sync token"""
+        self.__syncTokenTask = None
+        if not task.cancelled() and task.exception() is not None:
+            print(
+                'ERROR: Writing sync token failed: %s' % task.exception(),
+                file=sys.stderr
+            )
+
+    async def __saveSyncToken(self):
+        """Write latest sync token to sync cache outside of the event loop"""
+        if self.__syncTokenHandle is not None:
+            self.__syncTokenHandle.cancel()
+            self.__syncTokenHandle = None
+
+        syncToken = self.__syncToken
+        if syncToken is None or syncToken == self.__syncTokenSaved:
+            return
+
+        try:
+            await executor().runBlocking(
+                self.__writeSyncCache,
+                json.dumps(
+                    {
+                        "user_id": self.__matrixApi.user_id,
+                        "next_batch": syncToken
+                    },
+                    indent=4
+                )
+            )
+            self.__syncTokenSaved = syncToken
+        except OSError as e:
+            print('ERROR: Writing sync token failed: %s' % e, file=sys.stderr)
+
+    def __writeSyncCache(self, data: str):
+        """Write sync cache file atomically"""
+        with safer.open(self._config['synccache'], 'w') as f:
+            f.write(data)
+
+    async def _syncError(self, response: nio.SyncError):
+        """Wait before next sync if sync was rate limited"""
+        if response.status_code == 'M_LIMIT_EXCEEDED':
+            await asyncio.sleep((response.retry_after_ms or 5000) / 1000)
 
     async def _run(self):
+        # Get joined rooms once, keep them updated by sync afterwards
+        joinedRoomsResponse = await self.__matrixApi.joined_rooms()
+        if isinstance(joinedRoomsResponse, nio.JoinedRoomsResponse):
+            for roomId in joinedRoomsResponse.rooms:
+                joinedRooms().add(roomId)
+
+        # Start plugins in background to answer commands immediately
+        self.__pluginStartup = \
+            asyncio.ensure_future(pluginCollection().startup())
+
+        # Start periodic jobs of plugins
+        scheduler().start()
+
         self.__matrixApi.add_event_callback(
             self._receiveMessage,
             nio.RoomMessageText
         )
-        await self.__matrixApi.sync_forever(timeout=30000, full_state=True)
+        self.__matrixApi.add_response_callback(
+            self._syncResponse,
+            nio.SyncResponse
+        )
+        self.__matrixApi.add_response_callback(
+            self._syncError,
+            nio.SyncError
+        )
+
+        # Resume from cached sync token or request full state
+        syncToken = self.__loadSyncToken()
+        if syncToken is not None:
+            print('MATRIX: Resume sync from cached sync token.')
+        else:
+            print('MATRIX: Initial sync with full state.')
+
+        # Use uploaded sync filter or fallback to inline filter
+        syncFilter = await self.__getSyncFilterId()
+        if syncFilter is None:
+            syncFilter = self.__getSyncFilter()
+
+        await self.__matrixApi.sync_forever(
+            timeout=30000,
+            sync_filter=syncFilter,
+            since=syncToken,
+            full_state=(syncToken is None)
+        )
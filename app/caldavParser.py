@@ -0,0 +1,122 @@
+"""
+CalDAV sync-collection reports (RFC 6578)
+
+Builds the report request and reads the multistatus response into the
+new sync token and the changed and removed calendar resources.
+"""
+
+import hashlib
+import io
+import xml.etree.ElementTree
+import xml.sax.saxutils
+
+# Namespaces of WebDAV and CalDAV elements
+_davNamespace = '{DAV:}'
+_caldavNamespace = '{urn:ietf:params:xml:ns:caldav}'
+
+
+def getSyncRequest(syncToken: str = None) -> str:
+    """Build body of sync-collection report
+
+    Parameters
+    ----------
+    syncToken : str
+        Token of last sync, None for initial sync of all resources
+
+    Returns
+    -------
+    str
+        XML body requesting etag and calendar data of changed resources
+    """
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<d:sync-collection xmlns:d="DAV:"'
+        ' xmlns:c="urn:ietf:params:xml:ns:caldav">'
+        '<d:sync-token>%s</d:sync-token>'
+        '<d:sync-level>1</d:sync-level>'
+        '<d:prop><d:getetag/><c:calendar-data/></d:prop>'
+        '</d:sync-collection>'
+    ) % xml.sax.saxutils.escape(syncToken or '')
+
+
+def _isStatus(statusElement, code: int) -> bool:
+    """ Return if status line (HTTP/1.1 200 OK) has status code """
+    if statusElement is None or statusElement.text is None:
+        return False
+    return statusElement.text.split()[1:2] == [str(code)]
+
+
+def _parseResponse(response, result: dict):
+    """ Add changed, removed or truncated resource of response """
+    href = response.findtext(_davNamespace + 'href')
+    status = response.find(_davNamespace + 'status')
+
+    if _isStatus(status, 404):
+        result['removed'].append(href)
+        return
+
+    if _isStatus(status, 507):
+        result['truncated'] = True
+        return
+
+    for propstat in response.findall(_davNamespace + 'propstat'):
+        if not _isStatus(propstat.find(_davNamespace + 'status'), 200):
+            continue
+
+        prop = propstat.find(_davNamespace + 'prop')
+        calendarData = prop.findtext(_caldavNamespace + 'calendar-data')
+        if calendarData is None and \
+                prop.find(_davNamespace + 'getetag') is None:
+            continue
+
+        # Resources without calendar data have to be downloaded
+        if calendarData is None:
+            result['changed'][href] = (None, None)
+        else:
+            result['changed'][href] = (
+                hashlib.sha256(calendarData.encode()).hexdigest(),
+                calendarData
+            )
+
+
+def parseSyncResponse(text: str) -> dict:
+    """Parse multistatus response of sync-collection report
+
+    Parameters
+    ----------
+    text : str
+        XML body of response
+
+    Returns
+    -------
+    dict
+        New sync token ('syncToken'), changed resources by href as
+        tuple of content hash and calendar data ('changed'), hrefs of
+        removed resources ('removed') and if the server returned only
+        a part of the changes ('truncated')
+    """
+    result = {
+        'syncToken': None,
+        'changed': {},
+        'removed': [],
+        'truncated': False,
+    }
+
+    parents = []
+    for action, element in xml.etree.ElementTree.iterparse(
+            io.StringIO(text), events=('start', 'end')):
+        if action == 'start':
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if element.tag == _davNamespace + 'sync-token':
+            result['syncToken'] = element.text
+        elif element.tag == _davNamespace + 'response':
+            _parseResponse(element, result)
+
+            # Free parsed response
+            if len(parents) > 0:
+                parents[-1].remove(element)
+
+    return result
@@ -0,0 +1,445 @@
+"""
+Calendar parsing and event expansion
+
+Reads ical, pretalx json and xcal files and expands their events in an
+interval to calendarEvent records. Parsed calendars are cached in each
+worker process.
+"""
+
+import collections
+import datetime
+import heapq
+import icalendar
+import io
+import json
+import pytz
+import recurring_ical_events
+import xml.etree.ElementTree
+
+from app.xmlUtils import getLocalName
+
+# Timezone of events
+TIMEZONE = pytz.timezone('Europe/Berlin')
+
+# Parsed calendars by content hash, kept per worker process and limited
+# by length of parsed texts. Parsed calendars need many times the memory
+# of their text.
+_calendarCache = collections.OrderedDict()
+_calendarCacheLength = 0
+
+# Default limit of cached text length
+CACHE_LIMIT = 8 * 1024 * 1024
+
+# Date formats of xcal
+_xcalDateFormats = ['%Y%m%dT%H%M%S', '%Y%m%d']
+
+
+class calendarCacheMiss(LookupError):
+    """
+    Calendars are neither cached in the worker process nor given as text
+    """
+
+    def __init__(self, hashes: list):
+        super().__init__(hashes)
+        self.hashes = hashes
+
+
+class calendarEvent:
+    """
+    Compact record of an expanded event
+
+    Start and end are timestamps, texts are plain strings. The output
+    line is rendered once by the plugin after parsing. Uid and
+    recurrence id (timestamp of the original start, only for recurring
+    events) identify an event across refreshes.
+    """
+
+    __slots__ = (
+        'calendarId', 'start', 'end', 'summary', 'location', 'description',
+        'uid', 'recurrenceId', 'output'
+    )
+
+    def __init__(
+            self, calendarId: str, start: float, end: float,
+            summary: str = None, location: str = None,
+            description: str = None, uid: str = None,
+            recurrenceId: float = None):
+        self.calendarId = calendarId
+        self.start = start
+        self.end = end
+        self.summary = summary
+        self.location = location
+        self.description = description
+        self.uid = uid
+        self.recurrenceId = recurrenceId
+        self.output = None
+
+    def getKey(self) -> str:
+        """ Get key to identify event across refreshes """
+        return "%s|%s" % (
+            self.uid,
+            '' if self.recurrenceId is None else self.recurrenceId
+        )
+
+
+def parseIcal(text: str) -> icalendar.Calendar:
+    """Parse ical file
+
+    Parameters
+    ----------
+    text : str
+        Content of file
+
+    Returns
+    -------
+    icalendar.Calendar
+    """
+    return icalendar.Calendar.from_ical(text)
+
+
+def parsePretalxJson(text: str) -> list:
+    """Import events from pretalx json schedule
+
+    Parameters
+    ----------
+    text : str
+        Content of file
+
+    Returns
+    -------
+    list
+        Events sorted by start as tuples of start and end timestamp,
+        summary, location, description and uid
+    """
+    jsonFormat = json.loads(text)
+
+    events = []
+    for day in jsonFormat['schedule']['conference']['days']:
+        for room, roomEvents in day['rooms'].items():
+            for event in roomEvents:
+
+                # Get start time and duration (HH:MM)
+                dtstart = datetime.datetime.fromisoformat(
+                    event['date']
+                ).astimezone(TIMEZONE)
+                hours, minutes = event['duration'].split(':')
+
+                events.append((
+                    dtstart.timestamp(),
+                    (
+                        dtstart + datetime.timedelta(
+                            hours=int(hours), minutes=int(minutes)
+                        )
+                    ).timestamp(),
+                    event.get('title'),
+                    room,
+                    event.get('description'),
+                    event.get('guid'),
+                ))
+
+    return sorted(events, key=lambda c: c[0])
+
+
+def _parseXcalDate(value: str) -> datetime.datetime:
+    """ Parse xcal date or date-time, floating times use event timezone """
+    value = value.strip()
+    isUtc = value.endswith('Z')
+    value = value.rstrip('Z')
+
+    for dateFormat in _xcalDateFormats:
+        try:
+            dt = datetime.datetime.strptime(value, dateFormat)
+            break
+        except ValueError:
+            pass
+    else:
+        dt = datetime.datetime.fromisoformat(value)
+
+    if isUtc:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+
+    if dt.tzinfo is None:
+        return TIMEZONE.localize(dt)
+    return dt.astimezone(TIMEZONE)
+
+
+def parseXcal(text: str) -> list:
+    """Import events from xcal schedule incrementally
+
+    Each vevent is converted and removed from the tree after it was
+    read, so the tree never holds more than one event.
+
+    Parameters
+    ----------
+    text : str
+        Content of file
+
+    Returns
+    -------
+    list
+        Events sorted by start as tuples of start and end timestamp,
+        summary, location, description and uid
+    """
+    events = []
+    parents = []
+    for action, element in xml.etree.ElementTree.iterparse(
+            io.StringIO(text), events=('start', 'end')):
+        if action == 'start':
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if getLocalName(element.tag) != 'vevent':
+            continue
+
+        properties = {
+            getLocalName(child.tag): child.text
+            for child in element
+        }
+        events.append((
+            _parseXcalDate(properties['dtstart']).timestamp(),
+            _parseXcalDate(properties['dtend']).timestamp(),
+            properties.get('summary'),
+            properties.get('location'),
+            properties.get('description'),
+            properties.get('uid'),
+        ))
+
+        # Free converted event
+        if len(parents) > 0:
+            parents[-1].remove(element)
+
+    return sorted(events, key=lambda c: c[0])
+
+
+# Parser by calendar filetype
+_parsers = {
+    'ical': parseIcal,
+    'json': parsePretalxJson,
+    'xcal': parseXcal,
+}
+
+
+def parseFile(filetype: str, text: str):
+    """Parse calendar file
+
+    Parameters
+    ----------
+    filetype : str
+        Format of file: ical, json (pretalx) or xcal
+    text : str
+        Content of file
+
+    Returns
+    -------
+    icalendar.Calendar or list
+        Calendar for ical, sorted events for imported formats
+
+    Raises
+    ------
+    ValueError
+        If filetype is invalid
+    """
+    try:
+        parser = _parsers[filetype]
+    except KeyError:
+        raise ValueError("Invalid filetype %s" % filetype)
+
+    return parser(text)
+
+
+def _getCalendar(
+        filetype: str, text: str, textHash: str, cacheLimit: int):
+    """ Get parsed calendar from cache or parse file """
+    global _calendarCacheLength
+
+    try:
+        _calendarCache.move_to_end(textHash)
+        return _calendarCache[textHash][0]
+    except KeyError:
+        pass
+
+    if text is None:
+        raise calendarCacheMiss([textHash])
+
+    calendar = parseFile(filetype, text)
+    _calendarCache[textHash] = (calendar, len(text))
+    _calendarCacheLength += len(text)
+
+    # Remove least recently used calendars, but keep the current one
+    while _calendarCacheLength > cacheLimit and \
+            len(_calendarCache) > 1:
+        _, (_, length) = _calendarCache.popitem(last=False)
+        _calendarCacheLength -= length
+
+    return calendar
+
+
+def _getTimestamp(dt) -> float:
+    """ Convert date or datetime to timestamp """
+
+    # Convert date to datetime to handle whole day events
+    if type(dt) is datetime.date:
+        dt = TIMEZONE.localize(
+            datetime.datetime(year=dt.year, month=dt.month, day=dt.day)
+        )
+
+    return dt.timestamp()
+
+
+def _toString(value) -> str:
+    """ Convert ical property to plain string """
+    if value is None:
+        return None
+    return str(value)
+
+
+def _getRecurringUids(calendar: icalendar.Calendar) -> set:
+    """ Get uids of recurring events and their modified occurrences """
+    return {
+        str(component.get('UID'))
+        for component in calendar.walk('VEVENT')
+        if 'RRULE' in component or 'RDATE' in component
+        or 'RECURRENCE-ID' in component
+    }
+
+
+def _expandIcal(
+        calendarId: str, calendar: icalendar.Calendar,
+        start: datetime.datetime, end: datetime.datetime) -> list:
+    """ Expand recurring events of ical in interval """
+    recurringUids = _getRecurringUids(calendar)
+
+    events = []
+    for event in recurring_ical_events.of(
+            calendar, components=["VEVENT"]).between(start, end):
+        uid = _toString(event.get('UID'))
+
+        # Expansion sets a recurrence id for single events, too
+        recurrenceId = None
+        if uid in recurringUids and event.get('RECURRENCE-ID') is not None:
+            recurrenceId = _getTimestamp(event.get('RECURRENCE-ID').dt)
+
+        events.append(calendarEvent(
+            calendarId,
+            _getTimestamp(event.get('DTSTART').dt),
+            _getTimestamp(event.get('DTEND').dt),
+            _toString(event.get('SUMMARY')),
+            _toString(event.get('LOCATION')),
+            _toString(event.get('DESCRIPTION')),
+            uid,
+            recurrenceId,
+        ))
+
+    return sorted(events, key=lambda c: c.start)
+
+
+def _filterEvents(
+        calendarId: str, events: list,
+        start: datetime.datetime, end: datetime.datetime) -> list:
+    """ Get sorted imported events overlapping interval """
+    start = TIMEZONE.localize(start).timestamp()
+    end = TIMEZONE.localize(end).timestamp()
+    return [
+        calendarEvent(calendarId, *event)
+        for event in events
+        if event[1] > start and event[0] < end
+    ]
+
+
+def expandCalendar(
+        calendarId: str, filetype: str, text: str, textHash: str,
+        start: datetime.datetime, end: datetime.datetime,
+        cacheLimit: int = CACHE_LIMIT) -> list:
+    """Parse calendar and expand its events in interval
+
+    Parameters
+    ----------
+    calendarId : str
+        Id of calendar added to events
+    filetype : str
+        Format of file: ical, json (pretalx) or xcal
+    text : str
+        Content of file, None to use the calendar cached in this process
+    textHash : str
+        Hash of content to reuse calendars parsed before in this process
+    start : datetime.datetime
+        Start of interval
+    end : datetime.datetime
+        End of interval
+    cacheLimit : int
+        Maximum length of texts of calendars cached in this process
+
+    Returns
+    -------
+    list
+        Events as calendarEvent sorted by start
+
+    Raises
+    ------
+    calendarCacheMiss
+        If text is None and the calendar is not cached
+    """
+    calendar = _getCalendar(filetype, text, textHash, cacheLimit)
+
+    if isinstance(calendar, icalendar.Calendar):
+        return _expandIcal(calendarId, calendar, start, end)
+
+    return _filterEvents(calendarId, calendar, start, end)
+
+
+def expandResources(
+        calendarId: str, resources: list,
+        start: datetime.datetime, end: datetime.datetime,
+        cacheLimit: int = CACHE_LIMIT) -> list:
+    """Parse ical resources of a collection and expand events in interval
+
+    Resources are parsed separately, so only changed resources have to
+    be parsed again.
+
+    Parameters
+    ----------
+    calendarId : str
+        Id of calendar added to events
+    resources : list
+        Tuples of content hash and ical text, text is None to use the
+        calendar cached in this process
+    start : datetime.datetime
+        Start of interval
+    end : datetime.datetime
+        End of interval
+    cacheLimit : int
+        Maximum length of texts of calendars cached in this process
+
+    Returns
+    -------
+    list
+        Events as calendarEvent sorted by start
+
+    Raises
+    ------
+    calendarCacheMiss
+        With all hashes of resources without text which are not cached
+    """
+    missing = [
+        textHash
+        for textHash, text in resources
+        if text is None and textHash not in _calendarCache
+    ]
+    if len(missing) > 0:
+        raise calendarCacheMiss(missing)
+
+    return list(
+        heapq.merge(
+            *[
+                _expandIcal(
+                    calendarId,
+                    _getCalendar('ical', text, textHash, cacheLimit),
+                    start,
+                    end
+                )
+                for textHash, text in resources
+            ],
+            key=lambda c: c.start
+        )
+    )
@@ -0,0 +1,83 @@
+import asyncio
+import collections
+import traceback
+
+
+class commandDispatcher:
+    """
+    Run command handlers outside of the sync callback
+
+    Commands of the same room are handled in order, commands of different
+    rooms run concurrently limited by a global concurrency cap.
+    """
+
+    # Singleton instance
+    __instance = None
+
+    # Default config
+    __configDefault = {
+        'concurrency': 4,
+        'queue_size': 100,
+    }
+
+    def __new__(singletonClass, dispatcherConfig: dict = None):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(commandDispatcher, singletonClass).__new__(
+                    singletonClass
+                )
+            singletonClass.__instance.__initialize(dispatcherConfig or {})
+        return singletonClass.__instance
+
+    def __initialize(self, dispatcherConfig: dict):
+        """Initialize dispatcher state"""
+        self.__config = {**self.__configDefault, **dispatcherConfig}
+        self.__semaphore = asyncio.Semaphore(self.__config['concurrency'])
+        self.__queues = {}
+        self.__workers = {}
+        self.__pending = 0
+
+    def dispatch(self, roomId: str, handler) -> bool:
+        """Enqueue coroutine function handling a command of a room
+
+        Returns
+        -------
+        bool
+            False if the queue is full and the command was dropped
+        """
+        if self.__pending >= self.__config['queue_size']:
+            print(
+                "Command queue full, dropping command for room %s" % roomId
+            )
+            return False
+
+        self.__pending += 1
+        self.__queues.setdefault(roomId, collections.deque()).append(handler)
+
+        # Start worker for room if not running
+        if roomId not in self.__workers:
+            self.__workers[roomId] = \
+                asyncio.get_event_loop().create_task(self.__worker(roomId))
+
+        return True
+
+    async def __worker(self, roomId: str):
+        """Run queued handlers for a single room one after another"""
+        queue = self.__queues[roomId]
+        try:
+            while len(queue) > 0:
+                handler = queue.popleft()
+                try:
+                    async with self.__semaphore:
+                        await handler()
+                except Exception:
+                    print(
+                        "Command in room %s failed:\n%s"
+                        % (roomId, traceback.format_exc())
+                    )
+                finally:
+                    self.__pending -= 1
+        finally:
+            del self.__workers[roomId]
+            del self.__queues[roomId]
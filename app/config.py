@@ -56,11 +56,6 @@ class config:
         if configErrors:
             sys.exit(1)
 
-    def __save(self):
-        """Write configuration to yaml file"""
-        with open(self.__filename, 'w') as configfile:
-            yaml.dump(self.__config, configfile)
-
     def getConfig(self) -> dict:
         return self.__config
 
@@ -70,6 +65,38 @@ class config:
     def getMatrixRooms(self) -> list:
         return self.__config['matrix']['rooms']
 
+    def getAllRooms(self) -> list:
+        """ Get matrix rooms and rooms from all plugin configurations """
+        rooms = list(self.getMatrixRooms())
+
+        # Collect room lists of plugins, keywords and plugin sources
+        # (e.g. feeds or calendars) at any depth
+        values = [self.__config.get('plugins') or {}]
+        while len(values) > 0:
+            value = values.pop()
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    if key == 'rooms' and isinstance(item, list):
+                        rooms += [room for room in item if room not in rooms]
+                    else:
+                        values.append(item)
+            elif isinstance(value, list):
+                values += value
+
+        return rooms
+
+    def getHttpConfig(self) -> dict:
+        """ Get HTTP client configuration """
+        return self.__config.get('http') or {}
+
+    def getStateConfig(self) -> dict:
+        """ Get state store configuration """
+        return self.__config.get('state') or {}
+
+    def getExecutorConfig(self) -> dict:
+        """ Get executor configuration """
+        return self.__config.get('executor') or {}
+
     def getPluginConfig(self, plugin: str) -> dict:
         """ Get plugin configuration """
         try:
@@ -79,12 +106,6 @@ class config:
 
         return pluginConfig
 
-    def setPluginConfig(self, plugin: str, data: dict):
-        """ Set plugin configuration """
-        self.__config['plugins'][plugin] = data
-        self.__save()
-        return self.__config['plugins'][plugin]
-
     def isPluginEnabled(self, plugin: str) -> bool:
         """ Return if plugin is enabled """
         try:
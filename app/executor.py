@@ -0,0 +1,105 @@
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
+import functools
+import multiprocessing
+
+from app.config import config
+
+
+class executor:
+    """
+    Executors to keep the event loop responsive
+
+    CPU-heavy functions (e.g. parsing) run in a process pool, blocking
+    calls run in a thread pool. Functions for the process pool have to
+    be module-level functions with picklable arguments and results, so
+    parsers return plain records with __slots__ (e.g. calendarEvent)
+    to keep the transfer between processes small.
+    """
+
+    # Singleton instance
+    __instance = None
+
+    # Default config
+    __configDefault = {
+        'processes': 2,
+        'threads': 4,
+    }
+
+    # Pools, created on first use
+    __processPool = None
+    __threadPool = None
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(executor, singletonClass).__new__(singletonClass)
+            singletonClass.__instance.__config = {
+                **singletonClass.__configDefault,
+                **config().getExecutorConfig()
+            }
+        return singletonClass.__instance
+
+    def __getThreadPool(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Get thread pool"""
+        if self.__threadPool is None:
+            self.__threadPool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.__config['threads'],
+                thread_name_prefix='spacebot'
+            )
+        return self.__threadPool
+
+    def __getProcessPool(self) -> concurrent.futures.Executor:
+        """Get process pool or thread pool if processes are disabled"""
+        if self.__config['processes'] == 0:
+            return self.__getThreadPool()
+
+        if self.__processPool is None:
+            # Spawn workers, forking a process with running threads is unsafe
+            self.__processPool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.__config['processes'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self.__processPool
+
+    async def runCpu(self, func, *args, **kwargs):
+        """Run CPU-heavy function in process pool
+
+        If a worker died (e.g. killed for memory), the broken pool is
+        replaced and the function is run once more.
+        """
+        pool = self.__getProcessPool()
+        try:
+            return await asyncio.get_event_loop().run_in_executor(
+                pool, functools.partial(func, *args, **kwargs)
+            )
+        except concurrent.futures.process.BrokenProcessPool as e:
+            print("Process pool is broken, starting new workers: %s" % e)
+
+            # Another call may have replaced the pool already
+            if self.__processPool is pool:
+                self.__processPool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        return await asyncio.get_event_loop().run_in_executor(
+            self.__getProcessPool(),
+            functools.partial(func, *args, **kwargs)
+        )
+
+    async def runBlocking(self, func, *args, **kwargs):
+        """Run blocking function in thread pool"""
+        return await asyncio.get_event_loop().run_in_executor(
+            self.__getThreadPool(),
+            functools.partial(func, *args, **kwargs)
+        )
+
+    def shutdown(self):
+        """Shutdown all pools"""
+        if self.__processPool is not None:
+            self.__processPool.shutdown(cancel_futures=True)
+            self.__processPool = None
+        if self.__threadPool is not None:
+            self.__threadPool.shutdown(cancel_futures=True)
+            self.__threadPool = None
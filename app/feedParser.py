@@ -0,0 +1,242 @@
+"""
+RSS and Atom feed parsing
+
+Reads feeds into compact feedEntry records, either complete with
+feedparser or chunk by chunk while a feed is downloaded.
+"""
+
+import datetime
+import email.utils
+import feedparser
+import itertools
+import time
+import xml.etree.ElementTree
+
+from app.xmlUtils import getLocalName
+
+# Namespaces of elements and attributes in feeds
+_atomNamespace = '{http://www.w3.org/2005/Atom}'
+_rdfNamespace = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}'
+
+
+class feedEntry:
+    """
+    Compact record of a feed entry with only the announced fields
+    """
+
+    __slots__ = ('guid', 'author', 'title', 'link', 'published', 'updated')
+
+    def __init__(
+            self, guid: str, author: str, title: str, link: str,
+            published: int, updated: int = 0):
+        self.guid = guid
+        self.author = author
+        self.title = title
+        self.link = link
+        self.published = published
+        self.updated = updated
+
+
+def _getPublished(entry) -> int:
+    """ Get timestamp of entry, fall back to time of last update """
+    published = entry.get('published_parsed') or entry.get('updated_parsed')
+    if published is None:
+        return 0
+    return int(time.mktime(published))
+
+
+def _getUpdated(entry) -> int:
+    """ Get timestamp of last update, fall back to time of publishing """
+    updated = entry.get('updated_parsed') or entry.get('published_parsed')
+    if updated is None:
+        return 0
+    return int(time.mktime(updated))
+
+
+def parseFeed(text, limit: int = None) -> list:
+    """Parse RSS or Atom feed
+
+    Parameters
+    ----------
+    text : str or bytes
+        Content of feed
+    limit : int
+        Maximum number of entries to keep from the start of the feed
+
+    Returns
+    -------
+    list
+        Entries in feed order as feedEntry
+    """
+    return [
+        feedEntry(
+            entry.get('id') or entry.get('link', ''),
+            entry.get('author', ''),
+            entry.get('title', ''),
+            entry.get('link', ''),
+            _getPublished(entry),
+            _getUpdated(entry)
+        )
+        for entry in itertools.islice(
+            feedparser.parse(text).entries, limit
+        )
+    ]
+
+
+def _parseDate(value: str) -> int:
+    """Get timestamp of ISO 8601 or RFC 822 date like for feedparser
+
+    RFC 822 dates may start with the day, as the weekday is optional.
+
+    >>> len({
+    ...     _parseDate('01 May 2024 10:00:00 GMT'),
+    ...     _parseDate('Wed, 01 May 2024 10:00:00 GMT'),
+    ...     _parseDate('2024-05-01T10:00:00Z'),
+    ... })
+    1
+    >>> _parseDate('not a date') is None
+    True
+    """
+    try:
+        dt = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        try:
+            dt = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+
+    # Convert time tuple in UTC as done for feedparser results
+    return int(time.mktime(dt.utctimetuple()))
+
+
+def _parseEntry(element) -> feedEntry:
+    """ Get entry from item (RSS) or entry (Atom) element """
+    guid = element.get(_rdfNamespace + 'about')
+    author = title = link = ''
+    published = updated = None
+
+    for child in element:
+        name = getLocalName(child.tag)
+        text = (child.text or '').strip()
+
+        if name == 'title':
+            title = text
+        elif name == 'link':
+            # Atom links are attributes, use alternate link
+            if 'href' in child.attrib:
+                if link == '' and \
+                        child.get('rel', 'alternate') == 'alternate':
+                    link = child.get('href')
+            else:
+                link = text
+        elif name in ('guid', 'id'):
+            guid = text
+        elif name in ('author', 'creator'):
+            # Atom author has name and email
+            authorName = child.findtext(_atomNamespace + 'name')
+            if authorName is None:
+                author = text
+            elif child.findtext(_atomNamespace + 'email'):
+                author = "%s (%s)" % (
+                    authorName, child.findtext(_atomNamespace + 'email')
+                )
+            else:
+                author = authorName
+        elif name in ('pubDate', 'published', 'issued', 'date'):
+            published = _parseDate(text)
+        elif name in ('updated', 'modified'):
+            updated = _parseDate(text)
+
+    return feedEntry(
+        guid or link, author, title, link, published or updated or 0,
+        updated or published or 0
+    )
+
+
+class feedStreamParser:
+    """
+    Incremental parser for RSS 2.0, RSS 1.0 and Atom feeds
+
+    Chunks of a download are parsed as they arrive. Parsing stops at the
+    first seen entry (tuple of guid and update timestamp), after a
+    maximum number of entries or at a maximum size, so the rest of the
+    feed does not have to be downloaded. Feeds which are no well-formed
+    XML are parsed by feedparser at the end.
+    """
+
+    def __init__(
+            self, seen: frozenset = frozenset(), limit: int = None,
+            maxSize: int = None):
+        self.__seen = seen
+        self.__limit = limit
+        self.__maxSize = maxSize
+        self.__parser = \
+            xml.etree.ElementTree.XMLPullParser(events=('end',))
+        self.__chunks = []
+        self.__size = 0
+        self.__entries = []
+        self.__fallback = False
+        self.__truncated = False
+
+    def feed(self, chunk: bytes) -> bool:
+        """Parse next chunk of feed
+
+        Parameters
+        ----------
+        chunk : bytes
+            Next part of the downloaded feed
+
+        Returns
+        -------
+        bool
+            True if no further chunks are needed
+        """
+        # Keep chunks to parse them with feedparser if XML is invalid
+        self.__chunks.append(chunk)
+        self.__size += len(chunk)
+
+        if not self.__fallback:
+            try:
+                self.__parser.feed(chunk)
+                for _, element in self.__parser.read_events():
+                    if getLocalName(element.tag) not in ('item', 'entry'):
+                        continue
+
+                    entry = _parseEntry(element)
+                    element.clear()
+
+                    # Older entries are known already
+                    if (entry.guid, entry.updated) in self.__seen:
+                        return True
+
+                    self.__entries.append(entry)
+                    if self.__limit is not None and \
+                            len(self.__entries) >= self.__limit:
+                        return True
+            except xml.etree.ElementTree.ParseError:
+                self.__fallback = True
+
+        if self.__maxSize is not None and self.__size >= self.__maxSize:
+            self.__truncated = True
+            return True
+
+        return False
+
+    def isTruncated(self) -> bool:
+        """Return if reading stopped at maximum size"""
+        return self.__truncated
+
+    def close(self) -> list:
+        """Get parsed entries
+
+        Returns
+        -------
+        list
+            Entries in feed order as feedEntry
+        """
+        if self.__fallback:
+            return parseFeed(b''.join(self.__chunks), self.__limit)
+        return self.__entries
@@ -0,0 +1,240 @@
+import aiohttp
+
+from app import VERSION
+from app.config import config
+
+# Brotli decoding is optional and only negotiated if available
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    try:
+        import brotlicffi
+        HAS_BROTLI = True
+    except ImportError:
+        HAS_BROTLI = False
+
+
+class httpResponse:
+    """
+    Downloaded response of a (conditional) request
+
+    Cache validators of modified responses are only used for the next
+    request after the caller saved them with httpClient.saveValidators.
+    """
+
+    __slots__ = ('url', 'status', 'text', 'validators')
+
+    def __init__(
+            self, url: str, status: int, text: str = None,
+            validators: dict = None):
+        self.url = url
+        self.status = status
+        self.text = text
+        self.validators = validators
+
+    def isModified(self) -> bool:
+        """Return if response contains new content"""
+        return self.status == 200
+
+    def isNotModified(self) -> bool:
+        """Return if content is unchanged since last request"""
+        return self.status == 304
+
+
+class httpClient:
+    """
+    Shared HTTP client with connection pooling for all plugins
+    """
+
+    # Singleton instance
+    __instance = None
+
+    # Default config
+    __configDefault = {
+        'limit': 100,
+        'limit_per_host': 4,
+        'dns_cache_ttl': 300,
+        'connect_timeout': 10,
+        'read_timeout': 30,
+        'total_timeout': 60,
+    }
+
+    # Client session
+    __session = None
+
+    # Cache validators (ETag, Last-Modified) by cache key
+    __validators = {}
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(httpClient, singletonClass).__new__(singletonClass)
+            singletonClass.__instance.__config = {
+                **singletonClass.__configDefault,
+                **config().getHttpConfig()
+            }
+        return singletonClass.__instance
+
+    async def getSession(self) -> aiohttp.ClientSession:
+        """Get shared client session, create it on first use
+
+        Returns
+        -------
+        aiohttp.ClientSession
+        """
+        if self.__session is None or self.__session.closed:
+            self.__session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.__config['limit'],
+                    limit_per_host=self.__config['limit_per_host'],
+                    use_dns_cache=True,
+                    ttl_dns_cache=self.__config['dns_cache_ttl'],
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    total=self.__config['total_timeout'],
+                    connect=self.__config['connect_timeout'],
+                    sock_read=self.__config['read_timeout'],
+                ),
+                headers={
+                    'Accept-Encoding':
+                        'gzip, deflate, br' if HAS_BROTLI else 'gzip, deflate',
+                    'User-Agent': 'spacebot/%s' % VERSION,
+                },
+            )
+        return self.__session
+
+    async def fetch(
+            self, url: str, conditional: bool = True, cacheKey: str = None,
+            **kwargs) -> httpResponse:
+        """Download url and use saved cache validators
+
+        Parameters
+        ----------
+        url : str
+            Url to download
+        conditional : bool
+            Send If-None-Match / If-Modified-Since, disable if the caller
+            has no data from a previous download
+        cacheKey : str
+            Key of saved validators, defaults to url
+
+        Returns
+        -------
+        httpResponse
+            Response with status 304 and without text if not modified
+        """
+        headers = dict(kwargs.pop('headers', {}))
+        if conditional:
+            headers.update(self.__validators.get(cacheKey or url, {}))
+
+        session = await self.getSession()
+        async with session.get(url, headers=headers, **kwargs) as response:
+            if response.status == 304:
+                return httpResponse(url, 304)
+
+            if response.status != 200:
+                return httpResponse(url, response.status)
+
+            return httpResponse(
+                url,
+                200,
+                await response.text(),
+                self.__getValidators(response)
+            )
+
+    async def stream(
+            self, url: str, consumer, conditional: bool = True,
+            chunkSize: int = 65536, cacheKey: str = None,
+            **kwargs) -> httpResponse:
+        """Download url in chunks until the consumer has enough data
+
+        Parameters
+        ----------
+        url : str
+            Url to download
+        consumer : coroutine function
+            Called with every chunk (bytes) of the body, returns True to
+            stop reading
+        conditional : bool
+            Send If-None-Match / If-Modified-Since, disable if the caller
+            has no data from a previous download
+        chunkSize : int
+            Maximum bytes per chunk
+        cacheKey : str
+            Key of saved validators, defaults to url
+
+        Returns
+        -------
+        httpResponse
+            Response without text, the body was passed to the consumer
+        """
+        headers = dict(kwargs.pop('headers', {}))
+        if conditional:
+            headers.update(self.__validators.get(cacheKey or url, {}))
+
+        session = await self.getSession()
+        async with session.get(url, headers=headers, **kwargs) as response:
+            if response.status != 200:
+                return httpResponse(url, response.status)
+
+            # Stop reading and drop connection once consumer is done
+            async for chunk in response.content.iter_chunked(chunkSize):
+                if await consumer(chunk):
+                    break
+
+            return httpResponse(
+                url, 200, None, self.__getValidators(response)
+            )
+
+    def __getValidators(self, response: aiohttp.ClientResponse) -> dict:
+        """Get request headers with validators of response"""
+        validators = {}
+        if 'ETag' in response.headers:
+            validators['If-None-Match'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            validators['If-Modified-Since'] = \
+                response.headers['Last-Modified']
+        return validators
+
+    def saveValidators(self, response: httpResponse, cacheKey: str = None):
+        """Save validators of response for next request
+
+        Call only after the content of the response was processed, so
+        failed processing is retried with a full download.
+
+        Parameters
+        ----------
+        response : httpResponse
+            Response of fetch or stream
+        cacheKey : str
+            Key of saved validators, defaults to url
+        """
+        if response.validators is not None:
+            self.__validators[cacheKey or response.url] = response.validators
+
+    async def request(
+            self, method: str, url: str, **kwargs) -> httpResponse:
+        """Send request with any method (e.g. WebDAV REPORT)
+
+        Parameters
+        ----------
+        method : str
+            HTTP method
+        url : str
+            Request url
+
+        Returns
+        -------
+        httpResponse
+            Response with text for every status
+        """
+        session = await self.getSession()
+        async with session.request(method, url, **kwargs) as response:
+            return httpResponse(url, response.status, await response.text())
+
+    async def close(self):
+        """Close shared client session"""
+        if self.__session is not None and not self.__session.closed:
+            await self.__session.close()
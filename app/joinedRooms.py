@@ -0,0 +1,42 @@
+import nio
+
+
+class joinedRooms:
+    """
+    In-memory set of joined rooms
+
+    Updated by join responses and membership changes from sync responses,
+    so plugins can get joined rooms without a request to the homeserver.
+    """
+
+    # Singleton instance
+    __instance = None
+
+    # Joined room ids
+    __rooms = set()
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(joinedRooms, singletonClass).__new__(singletonClass)
+        return singletonClass.__instance
+
+    def add(self, roomId: str):
+        """Add joined room"""
+        self.__rooms.add(roomId)
+
+    def remove(self, roomId: str):
+        """Remove left room"""
+        self.__rooms.discard(roomId)
+
+    def update(self, response: nio.SyncResponse):
+        """Update joined rooms from sync response"""
+        for roomId in response.rooms.join:
+            self.__rooms.add(roomId)
+        for roomId in response.rooms.leave:
+            self.__rooms.discard(roomId)
+
+    def get(self) -> list:
+        """Return list of joined room ids"""
+        return sorted(self.__rooms)
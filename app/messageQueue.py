@@ -0,0 +1,227 @@
+import asyncio
+import heapq
+import itertools
+import nio
+import time
+
+
+class tokenBucket:
+    """
+    Global token bucket with priority aware waiters
+    """
+
+    def __init__(self, rate: float, burst: int):
+        """
+        Constructor
+
+        Parameters
+        ----------
+        rate : float
+            Tokens added per second
+        burst : int
+            Maximum number of tokens in bucket
+        """
+        self.__rate = rate
+        self.__burst = burst
+        self.__tokens = float(burst)
+        self.__updated = time.monotonic()
+        self.__blockedUntil = 0.0
+        self.__waiters = []
+        self.__sequence = itertools.count()
+        self.__timer = None
+
+    async def acquire(self, priority: int):
+        """Wait until a token is available for the given priority"""
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(
+            self.__waiters, (priority, next(self.__sequence), future)
+        )
+        self.__wakeup()
+        await future
+
+    def close(self):
+        """Cancel scheduled wakeup"""
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+
+    def block(self, seconds: float):
+        """Stop handing out tokens for the given time (e.g. rate limit)"""
+        self.__blockedUntil = max(
+            self.__blockedUntil, time.monotonic() + seconds
+        )
+        self.__tokens = 0.0
+
+    def __refill(self, now: float):
+        """Add tokens for the elapsed time"""
+        self.__tokens = min(
+            float(self.__burst),
+            self.__tokens + (now - self.__updated) * self.__rate
+        )
+        self.__updated = now
+
+    def __wakeup(self):
+        """Hand out available tokens to waiters by priority"""
+        self.__timer = None
+        now = time.monotonic()
+        self.__refill(now)
+
+        while self.__waiters and now >= self.__blockedUntil:
+            # Drop waiters which were cancelled in the meantime
+            if self.__waiters[0][2].done():
+                heapq.heappop(self.__waiters)
+                continue
+            if self.__tokens < 1:
+                break
+            self.__tokens -= 1
+            heapq.heappop(self.__waiters)[2].set_result(True)
+
+        # Schedule next wakeup for remaining waiters
+        if self.__waiters and self.__timer is None:
+            delay = max(
+                self.__blockedUntil - now,
+                (1 - self.__tokens) / self.__rate
+            )
+            self.__timer = asyncio.get_event_loop().call_later(
+                max(delay, 0), self.__wakeup
+            )
+
+
+class messageQueue:
+    """
+    Central queue for all outgoing matrix messages
+
+    Messages are send in order per room, limited by a global token bucket
+    and prioritized by lanes.
+    """
+
+    # Priority lanes
+    PRIORITY_HIGH = 0
+    PRIORITY_NORMAL = 1
+    PRIORITY_LOW = 2
+
+    # Singleton instance
+    __instance = None
+
+    # Default config
+    __configDefault = {
+        'rate': 1.0,
+        'burst': 10,
+        'max_retries': 5,
+    }
+
+    def __new__(singletonClass, queueConfig: dict = None):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(messageQueue, singletonClass).__new__(singletonClass)
+            singletonClass.__instance.__initialize(queueConfig or {})
+        return singletonClass.__instance
+
+    def __initialize(self, queueConfig: dict):
+        """Initialize queue state"""
+        self.__config = {**self.__configDefault, **queueConfig}
+        self.__matrixApi = None
+        self.__bucket = tokenBucket(
+            self.__config['rate'], self.__config['burst']
+        )
+        self.__queues = {}
+        self.__workers = {}
+        self.__sequence = itertools.count()
+
+    def setMatrixApi(self, matrixApi: nio.AsyncClient):
+        """Set matrix client used to send messages"""
+        self.__matrixApi = matrixApi
+
+    def send(
+            self, roomId: str, content: dict,
+            priority: int = PRIORITY_NORMAL) -> asyncio.Future:
+        """Enqueue message for room
+
+        Returns
+        -------
+        asyncio.Future
+            Resolves to the last nio response (RoomSendResponse or
+            RoomSendError) or None if sending raised an exception
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        if roomId not in self.__queues:
+            self.__queues[roomId] = asyncio.PriorityQueue()
+        self.__queues[roomId].put_nowait(
+            (priority, next(self.__sequence), content, future)
+        )
+
+        # Start worker for room if not running
+        if roomId not in self.__workers:
+            self.__workers[roomId] = loop.create_task(self.__worker(roomId))
+            self.__workers[roomId].add_done_callback(self.__workerDone)
+
+        return future
+
+    def __workerDone(self, task: asyncio.Task):
+        """Log exception of finished worker"""
+        if not task.cancelled() and task.exception() is not None:
+            print("MATRIX: Message queue worker failed: %s" % task.exception())
+
+    async def close(self):
+        """Stop workers and scheduled wakeup of token bucket"""
+        self.__bucket.close()
+        workers = list(self.__workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    async def __worker(self, roomId: str):
+        """Send queued messages for a single room one after another"""
+        queue = self.__queues[roomId]
+        try:
+            while not queue.empty():
+                priority, _, content, future = queue.get_nowait()
+                response = await self.__send(roomId, content, priority)
+                if not future.done():
+                    future.set_result(response)
+        finally:
+            del self.__workers[roomId]
+
+    async def __send(self, roomId: str, content: dict, priority: int):
+        """Send message and retry on rate limit or connection errors"""
+        response = None
+        for attempt in range(0, self.__config['max_retries'] + 1):
+            await self.__bucket.acquire(priority)
+            try:
+                response = await self.__matrixApi.room_send(
+                    roomId,
+                    message_type="m.room.message",
+                    content=content
+                )
+            except Exception as e:
+                print(
+                    "MATRIX: Sending message to room %s failed: %s"
+                    % (roomId, e)
+                )
+                response = None
+                await asyncio.sleep(2 ** attempt)
+                continue
+
+            if isinstance(response, nio.RoomSendResponse):
+                return response
+
+            # Rate limited, pause all rooms for requested time
+            if response.status_code == 'M_LIMIT_EXCEEDED':
+                retryAfter = (response.retry_after_ms or 5000) / 1000
+                print(
+                    "MATRIX: Rate limited in room %s, retry after %.1fs"
+                    % (roomId, retryAfter)
+                )
+                self.__bucket.block(retryAfter)
+                continue
+
+            print(
+                "MATRIX: Sending message to room %s failed: %s"
+                % (roomId, response)
+            )
+            return response
+
+        return response
@@ -1,8 +1,15 @@
+import asyncio
+import math
 import pydeepmerge
 import sys
 
 from abc import ABC, abstractmethod
 from app.config import config
+from app.httpClient import httpClient, httpResponse
+from app.joinedRooms import joinedRooms
+from app.messageQueue import messageQueue
+from app.scheduler import scheduler
+from app.stateStore import stateStore
 
 
 class plugin(ABC):
@@ -20,6 +27,12 @@ class plugin(ABC):
     # Matrix Asyncclient
     __matrixApi = None
 
+    # Startup finished
+    __ready = False
+
+    # Config list of sources refreshed with _refreshLimited on startup
+    _refreshSources = None
+
     def getName(self) -> str:
         return self.__class__.__name__
 
@@ -31,6 +44,36 @@ class plugin(ABC):
         except LookupError as e:
             raise e
 
+    async def startup(self):
+        """Run initial asynchronous tasks like fetching data
+
+        Called concurrently for all plugins after initialization.
+        """
+        pass
+
+    def getStartupTimeout(self) -> float:
+        """Return maximum seconds for startup
+
+        Plugins refreshing sources on startup allow the refresh timeout
+        for each group of concurrently refreshed sources.
+        """
+        if '_startup_timeout' in self._config or \
+                self._refreshSources is None:
+            return self._config.get('_startup_timeout', 60)
+
+        return self._config['refresh_timeout'] * math.ceil(
+            len(self._config[self._refreshSources])
+            / self._config['refresh_concurrency']
+        )
+
+    def isReady(self) -> bool:
+        """Return if plugin finished startup"""
+        return self.__ready
+
+    def setReady(self):
+        """Mark plugin startup as finished"""
+        self.__ready = True
+
     def _loadConfig(self) -> dict:
         self._config = config().getPluginConfig(self.getName())
 
@@ -73,8 +116,58 @@ class plugin(ABC):
                     'Configuration for plugin %s not valid.' % self.getName()
             )
 
-    def _setConfig(self) -> dict:
-        config().setPluginConfig(self.getName(), self._config)
+    def _addJob(self, name: str, func, **kwargs):
+        """Register periodic job of plugin in central scheduler
+
+        See scheduler.addJob for available arguments. Runs are skipped
+        until the startup of the plugin finished.
+        """
+        scheduler().addJob(
+            '%s.%s' % (self.getName(), name), func, ready=self.isReady,
+            **kwargs
+        )
+
+    async def _refreshLimited(
+            self, semaphore: asyncio.Semaphore, name: str, func,
+            *args) -> bool:
+        """Run refresh of a single source limited by concurrency and timeout
+
+        Parameters
+        ----------
+        semaphore : asyncio.Semaphore
+            Semaphore shared by concurrent refreshes
+        name : str
+            Name of source for log output
+        func : coroutine function
+            Refresh returning if it was successful
+        args
+            Arguments for function
+
+        Returns
+        -------
+        bool
+            Result of refresh, False on timeout to keep data from the
+            last successful refresh
+        """
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(
+                    func(*args), self._config['refresh_timeout']
+                )
+            except asyncio.TimeoutError:
+                print(
+                    "[%s] Refreshing %s timed out after %d seconds"
+                    % (self.getName(), name, self._config['refresh_timeout'])
+                )
+                return False
+
+    def _getState(self, key: str, default=None):
+        """Get runtime state value of plugin"""
+        return stateStore().get(self.getName(), key, default)
+
+    def _setState(self, key: str, value):
+        """Set runtime state value of plugin"""
+        stateStore().set(self.getName(), key, value)
 
     def _getConfigList(self, configName: str) -> dict:
         """ Return configuration sub list as dictionary """
@@ -94,16 +187,60 @@ class plugin(ABC):
     def getKeywords(self) -> str:
         return ','.join(self._keywords.keys())
 
-    async def _getJoinedRoomIds(self) -> list:
+    def __getCacheKey(self, url: str, key: str = None) -> str:
+        """Get key of cache validators separate for each plugin source"""
+        return '%s|%s' % (self.getName(), url if key is None else key)
+
+    async def _fetch(
+            self, url: str, conditional: bool = True, key: str = None,
+            **kwargs) -> httpResponse:
+        """Download url using conditional requests if possible
+
+        Validators are kept per plugin and key (e.g. feed id), defaulting
+        to the url, and are used only after saving them with
+        _saveValidators.
+        """
+        return await httpClient().fetch(
+            url, conditional, self.__getCacheKey(url, key), **kwargs
+        )
+
+    def _saveValidators(self, response: httpResponse, key: str = None):
+        """Save validators of response after its content was processed"""
+        httpClient().saveValidators(
+            response, self.__getCacheKey(response.url, key)
+        )
+
+    async def _stream(
+            self, url: str, consumer, conditional: bool = True,
+            key: str = None, **kwargs) -> httpResponse:
+        """Download url in chunks passed to consumer until it is done
+
+        Validators are handled like for _fetch.
+        """
+        return await httpClient().stream(
+            url, consumer, conditional,
+            cacheKey=self.__getCacheKey(url, key), **kwargs
+        )
+
+    async def _request(
+            self, method: str, url: str, **kwargs) -> httpResponse:
+        """Send request with any method"""
+        return await httpClient().request(method, url, **kwargs)
+
+    def _getJoinedRoomIds(self) -> list:
         """Return list of joined room ids"""
-        try:
-            return (await self.__matrixApi.joined_rooms()).rooms
-        except Exception as e:
-            print("Error getting joined rooms: %s" % e)
-            return []
+        return joinedRooms().get()
 
     async def _sendMessage(
-            self, message, roomId: str = None, messageType: str = "text"):
+            self, message, roomId: str = None, messageType: str = "text",
+            priority: int = messageQueue.PRIORITY_NORMAL) -> list:
+        """Enqueue message for all plugin rooms or given room
+
+        Returns
+        -------
+        list
+            Futures resolving to the responses of the message queue
+        """
 
         # Get rooms by plugin, global rooms or given parameter
         if roomId is None:
@@ -117,31 +254,27 @@ class plugin(ABC):
         if messageType not in ['text', 'notice', 'html']:
             raise ValueError("Wrong value for messageType")
 
+        futures = []
         for room in rooms:
             print(
                 "[%s] Send message in room %s:\n%s"
                 % (self.getName(), room, message)
             )
             if messageType in ['text', 'notice']:
-                messageResponse = await self.__matrixApi.room_send(
-                    room,
-                    message_type="m.room.message",
-                    content={
-                        "msgtype": "m.%s" % messageType,
-                        "body": "%s" % message
-                    }
-                )
+                content = {
+                    "msgtype": "m.%s" % messageType,
+                    "body": "%s" % message
+                }
             elif messageType in ['html']:
-                messageResponse = await self.__matrixApi.room_send(
-                    room,
-                    message_type="m.room.message",
-                    content={
-                        "msgtype": "m.text",
-                        "format": "org.matrix.custom.html",
-                        "body": "message",
-                        "formatted_body": "%s" % message
-                    }
-                )
+                content = {
+                    "msgtype": "m.text",
+                    "format": "org.matrix.custom.html",
+                    "body": "message",
+                    "formatted_body": "%s" % message
+                }
+            futures.append(messageQueue().send(room, content, priority))
+
+        return futures
 
     def _getIdsByRoomId(self, configName: str, roomId: str) -> list:
         """Get list of item id with roomId
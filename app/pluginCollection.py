@@ -113,6 +113,33 @@ class pluginCollection:
                 for childPackage in childPackages:
                     self.__scanPlugins(package + '.' + childPackage, matrixApi)
 
+    async def startup(self):
+        """Run startup of all plugins concurrently"""
+        await asyncio.gather(
+            *[
+                self.__startupPlugin(pluginName, plugin)
+                for pluginName, plugin in self.__plugins.items()
+            ]
+        )
+        print('All plugins started.')
+
+    async def __startupPlugin(self, pluginName: str, plugin):
+        """Run startup of a single plugin limited by startup timeout"""
+        timeout = plugin.getStartupTimeout()
+
+        try:
+            await asyncio.wait_for(plugin.startup(), timeout)
+        except asyncio.TimeoutError:
+            print(
+                '[%s] Startup timed out after %d seconds.'
+                % (pluginName, timeout)
+            )
+        except Exception as e:
+            print('[%s] Startup failed: %s' % (pluginName, e))
+
+        # Answer commands even on failed startup
+        plugin.setReady()
+
     async def help(self, controlsign: str, roomId: str) -> str:
         maxLengthKeywords = len(max(self.__keywords.keys(), key=len))
 
@@ -161,6 +188,11 @@ class pluginCollection:
                 and roomId not in self.__keywords[pluginName]['rooms']:
             return None
 
+        # Plugin startup not finished
+        if not self.__plugins[pluginName].isReady():
+            return "%s is still warming up. Please try again later." \
+                % pluginName
+
         # Run plugin method
         try:
             keywordMethod = getattr(
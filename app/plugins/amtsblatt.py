@@ -1,14 +1,8 @@
-import aiocron
-import aiohttp
-import asyncio
-import datetime
-import feedparser
-
-from time import mktime
-from datetime import datetime, timezone
-
+import app.feedParser
 import app.plugin
 from app.config import config
+from app.executor import executor
+from app.messageQueue import messageQueue
 
 
 class amtsblatt(app.plugin.plugin):
@@ -34,7 +28,7 @@ class amtsblatt(app.plugin.plugin):
         'rss',
     ]
 
-    # RSS object
+    # Parsed RSS entries
     __rss = None
 
     def __init__(self, matrixApi):
@@ -45,9 +39,12 @@ class amtsblatt(app.plugin.plugin):
             print(e)
             raise e
 
-        # Get RSS once and refresh by cron
-        asyncio.get_event_loop().run_until_complete(self.__getRss())
-        aiocron.crontab('0 */4 * * *', func=self.__getRss)
+        # Refresh RSS every 4 hours
+        self._addJob('refresh', self.__getRss, cron='0 */4 * * *', jitter=600)
+
+    async def startup(self):
+        """Get RSS once"""
+        await self.__getRss()
 
     def amtsblatt(self, parameter, roomId):
         """Return answer
@@ -58,44 +55,52 @@ class amtsblatt(app.plugin.plugin):
             Current link to latest Amtsblatt
         """
         try:
-            return self.__rss.entries[0].link
-        except IndexError:
+            return self.__rss[0].link
+        except (IndexError, TypeError):
             return "No valid RSS feed available. Please try again later"
 
     def __getRssLastEntryPublished(self):
-        return \
-            int(
-                datetime.fromtimestamp(
-                    mktime(self.__rss.entries[0].published_parsed),
-                    timezone.utc
-                ).timestamp()
-            )
+        return self.__rss[0].published
 
     async def __announce(self):
         # No new entry
-        if self.__getRssLastEntryPublished() <= self._config['published']:
+        if len(self.__rss) == 0 or self.__getRssLastEntryPublished() <= \
+                self._getState('published', self._config['published']):
             return
 
         await self._sendMessage(
             "%s: %s\n%s" % (
                 "Neu veröffentlicht",
-                self.__rss.entries[0].title,
-                self.__rss.entries[0].link
+                self.__rss[0].title,
+                self.__rss[0].link
             ),
-            messageType="notice"
+            messageType="notice",
+            priority=messageQueue.PRIORITY_LOW
         )
-        self._config['published'] = self.__getRssLastEntryPublished()
-        self._setConfig()
+        self._setState('published', self.__getRssLastEntryPublished())
 
     async def __getRss(self, announce=True):
         """Get and parse latest RSS feed"""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(self._config['rss']) as response:
-                print(
-                    "[%s] Refreshing RSS feed from %s"
-                    % (self.getName(), self._config['rss'])
-                )
-                self.__rss = feedparser.parse(await response.text())
+        print(
+            "[%s] Refreshing RSS feed from %s"
+            % (self.getName(), self._config['rss'])
+        )
+        response = await self._fetch(
+            self._config['rss'], conditional=(self.__rss is not None)
+        )
+        if response.isModified():
+            # Parse in process pool to keep event loop responsive
+            # Only the latest entry is used
+            self.__rss = await executor().runCpu(
+                app.feedParser.parseFeed, response.text, 1
+            )
+            self._saveValidators(response)
+        elif not response.isNotModified():
+            print(
+                "[%s] Error downloading RSS feed. HTTP status: %d"
+                % (self.getName(), response.status)
+            )
+            return
 
         if announce:
             await self.__announce()
@@ -1,17 +1,20 @@
-import aiocron
 import aiohttp
 import asyncio
 import datetime
-import icalendar
-import json
-import recurring_ical_events
+import hashlib
+import heapq
+import itertools
 import locale
 import pytz
-import os
-import xml.etree.ElementTree
+import re
+import time
+import urllib.parse
 
+import app.caldavParser
+import app.calendarParser
 import app.plugin
 from app.config import config
+from app.executor import executor
 
 
 class dates(app.plugin.plugin):
@@ -29,9 +32,17 @@ class dates(app.plugin.plugin):
 
     # Default config
     _configDefault = {
-        'locale': None
+        'locale': None,
+        'refresh_concurrency': 4,
+        'refresh_timeout': 60,
+        'search_days': None,
+        'search_limit': 10,
+        'cache_limit': app.calendarParser.CACHE_LIMIT,
     }
 
+    # Calendars are refreshed on startup
+    _refreshSources = 'calendar'
+
     # Required configuration values
     _configRequired = [
         'announce_interval',
@@ -43,12 +54,47 @@ class dates(app.plugin.plugin):
     # Calendar configurations
     __calendarConfig = {}
 
-    # Calendar objects
-    __calendar = {}
+    # Downloaded calendar files, CalDAV resources as
+    # {href: (content hash, ical text)}
+    __calendarText = {}
+
+    # Content hashes of downloaded calendar files
+    __calendarHash = {}
+
+    # Sync tokens of CalDAV calendars
+    __syncToken = {}
+
+    # Maximum number of reports for one CalDAV sync with truncated results
+    __syncMaxReports = 10
+
+    # Expanded interval (start, end) of parsed events by calendar id
+    __eventsInterval = {}
 
-    # Parsed events
+    # Parsed events as calendarEvent records by calendar id
     __events = {}
 
+    # Calendar ids by room id
+    __calendarIdsByRoom = {}
+
+    # Merged and limited events by room id and "__all" for all calendars
+    __eventsIndex = {}
+
+    # Inverted index of events for search by calendar id
+    # {calendar id: {token: set of events}}
+    __searchIndex = {}
+
+    # Heap of upcoming announcements
+    # (fire time, interval, sequence, room id, event)
+    __timeline = []
+
+    # Announcements are done up to this time
+    __announcedUntil = None
+
+    # Snapshots of events by calendar id to detect changes
+    # {'hash': content hash, 'until': end of interval,
+    #  'events': {event key: [start, end, summary, location]}}
+    __snapshot = {}
+
     def __init__(self, matrixApi):
         """ Start base class constructor """
         try:
@@ -75,36 +121,78 @@ class dates(app.plugin.plugin):
         # Get calendar configurations as dictionary
         self.__calendarConfig = self._getConfigList('calendar')
 
-        # Get ical once and refresh bycron
-        asyncio.get_event_loop().run_until_complete(self.__getIcals())
-        asyncio.get_event_loop().run_until_complete(self.__announce())
-        aiocron.crontab('*/60 * * * *', func=self.__getIcals)
-        aiocron.crontab('* * * * *', func=self.__announce)
+        # Get calendar ids by room id
+        self.__calendarIdsByRoom = {}
+        for calendarId, calendarConfig in self.__calendarConfig.items():
+            for roomId in calendarConfig.get('rooms', []):
+                self.__calendarIdsByRoom.setdefault(roomId, []) \
+                    .append(calendarId)
 
-    async def __getIcals(self):
-        """ Get iCals for all calendars """
-        for calendar in self._config['calendar']:
-            await self.__getIcal(calendar)
+        # Get snapshots from last run to detect changes during downtime
+        self.__snapshot = self._getState('snapshot', {})
+
+        # Announce events from current minute on
+        self.__announcedUntil = self.__getCurrentMinute() - 60
+
+        # Refresh ical hourly and check announcements every minute
+        self._addJob('refresh', self.__getIcals, cron='0 * * * *', jitter=300)
+        self._addJob('announce', self.__announce, cron='* * * * *')
 
-    async def __getIcal(self, calendarConfig: dict):
+    async def startup(self):
+        """ Get ical once """
+        await self.__getIcals()
+        await self.__announce()
+
+    async def __getIcals(self):
+        """ Get iCals for all calendars concurrently """
+        semaphore = asyncio.Semaphore(self._config['refresh_concurrency'])
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(calendarConfig['url']) as response:
-                    print(
-                        "[%s] Refreshing calendar '%s' from URL %s"
-                        % (
-                            self.getName(),
-                            calendarConfig['name'],
-                            calendarConfig['url']
-                        )
+            results = await asyncio.gather(
+                *[
+                    self._refreshLimited(
+                        semaphore,
+                        "calendar '%s'" % calendar['name'],
+                        self.__getIcal,
+                        calendar
                     )
-                    self.__calendar[calendarConfig['id']] = \
-                        self.__parseFile(
-                            calendarConfig,
-                            calendarConfig.get('type', 'ical'),
-                            await response.text()
-                        )
-                    self.__parseEvents(calendarConfig)
+                    for calendar in self._config['calendar']
+                ]
+            )
+
+            print(
+                "[%s] Refreshed %d of %d calendars"
+                % (self.getName(), results.count(True), len(results))
+            )
+        finally:
+            # Use refreshed calendars even if cancelled by startup timeout
+            self.__buildIndex()
+            self.__buildTimeline()
+
+    async def __getIcal(self, calendarConfig: dict) -> bool:
+        """ Get iCal and return if refresh was successful """
+        try:
+            print(
+                "[%s] Refreshing calendar '%s' from URL %s"
+                % (
+                    self.getName(),
+                    calendarConfig['name'],
+                    calendarConfig['url']
+                )
+            )
+            if calendarConfig.get('type', 'ical') == 'caldav':
+                success = await self.__syncCaldav(calendarConfig)
+            else:
+                success = await self.__downloadIcal(calendarConfig)
+
+            # Recalculate events for current interval, even if unchanged
+            if calendarConfig['id'] in self.__calendarHash:
+                await self.__parseEvents(calendarConfig)
+
+                # Announce added, moved and cancelled events
+                if calendarConfig.get('announce_changes', False):
+                    await self.__announceChanges(calendarConfig)
+
+            return success
 
         except Exception as e:
             # Something went wrong, remove parsed calendar
@@ -116,210 +204,465 @@ class dates(app.plugin.plugin):
                     e
                 )
             )
-            self.__calendar[calendarConfig['id']] = None
+            self.__calendarText.pop(calendarConfig['id'], None)
+            self.__calendarHash.pop(calendarConfig['id'], None)
+            self.__syncToken.pop(calendarConfig['id'], None)
+            self.__eventsInterval.pop(calendarConfig['id'], None)
+            return False
 
-    def __parseFile(self, calendarConfig: dict, filetype: str, text):
+    def __setCalendarHash(self, calendarId: str, calendarHash: str):
+        """ Set content hash, expand all events only for changed content """
+        if calendarHash != self.__calendarHash.get(calendarId):
+            self.__calendarHash[calendarId] = calendarHash
+            self.__eventsInterval.pop(calendarId, None)
+
+    async def __downloadIcal(self, calendarConfig: dict) -> bool:
+        """ Download calendar file and return if successful """
+        response = await self._fetch(
+            calendarConfig['url'],
+            conditional=(calendarConfig['id'] in self.__calendarHash),
+            key=calendarConfig['id']
+        )
 
-        # Parse ical format
-        if filetype == 'ical':
-            return icalendar.Calendar.from_ical(text)
+        if response.isModified():
+            self.__calendarText[calendarConfig['id']] = response.text
+            self.__setCalendarHash(
+                calendarConfig['id'],
+                hashlib.sha256(response.text.encode()).hexdigest()
+            )
+            self._saveValidators(response, calendarConfig['id'])
+        elif not response.isNotModified():
+            print(
+                "[%s] Error downloading calendar '%s'. HTTP status: %d"
+                % (
+                    self.getName(),
+                    calendarConfig['name'],
+                    response.status
+                )
+            )
 
-        # Parse json format (pretalx)
-        if filetype == 'json':
+        return response.isModified() or response.isNotModified()
 
-            jsonFormat = json.loads(text)
+    def __getCaldavAuth(self, calendarConfig: dict) -> dict:
+        """ Get request arguments for authentication at CalDAV server """
+        if 'username' not in calendarConfig:
+            return {}
+        return {
+            'auth': aiohttp.BasicAuth(
+                calendarConfig['username'],
+                calendarConfig.get('password', '')
+            )
+        }
 
-            # Build ical from json
-            icalFormat = "BEGIN:VCALENDAR" + os.linesep
-            icalFormat += "PRODID;X-RICAL-TZSOURCE=TZINFO:-//com.denhaven2/"\
-                          "NONSGML ri_cal gem//EN" + os.linesep
-            icalFormat += "CALSCALE:GREGORIAN" + os.linesep
-            icalFormat += "VERSION:2.0" + os.linesep
+    async def __syncCaldav(self, calendarConfig: dict) -> bool:
+        """ Sync changed resources of CalDAV calendar and return if successful
 
-            # Parse event elements
-            for day in jsonFormat['schedule']['conference']['days']:
-                for room in day['rooms']:
-                    for event in day['rooms'][room]:
+        Uses sync-collection reports (RFC 6578), so only resources changed
+        since the last sync token are transferred.
+        """
+        calendarId = calendarConfig['id']
+        resources = self.__calendarText.setdefault(calendarId, {})
+
+        for _ in range(self.__syncMaxReports):
+            response = await self._request(
+                'REPORT',
+                calendarConfig['url'],
+                data=app.caldavParser.getSyncRequest(
+                    self.__syncToken.get(calendarId)
+                ),
+                headers={
+                    'Content-Type': 'application/xml; charset=utf-8',
+                    'Depth': '0',
+                },
+                **self.__getCaldavAuth(calendarConfig)
+            )
 
-                        # Get start and end time
-                        dtstart = \
-                            datetime.datetime.fromisoformat(
-                                event['date']
-                            ).astimezone(
-                                pytz.timezone('Europe/Berlin')
-                            )
-                        duration = \
-                            datetime.datetime.strptime(
-                                event['duration'],
-                                '%H:%M'
-                            )
-                        dtend = \
-                            dtstart + \
-                            datetime.timedelta(
-                                hours=duration.hour,
-                                minutes=duration.minute
-                            )
+            # Server forgot the sync token, start again with all resources
+            if response.status in (403, 409) and \
+                    self.__syncToken.get(calendarId) is not None and \
+                    'valid-sync-token' in response.text:
+                print(
+                    "[%s] Sync token of calendar '%s' expired"
+                    % (self.getName(), calendarConfig['name'])
+                )
+                self.__syncToken.pop(calendarId)
+                resources.clear()
+                continue
+
+            if response.status != 207:
+                print(
+                    "[%s] Error syncing calendar '%s'. HTTP status: %d"
+                    % (
+                        self.getName(),
+                        calendarConfig['name'],
+                        response.status
+                    )
+                )
+                return False
 
-                        icalFormat += 'BEGIN:VEVENT' + os.linesep
-                        icalFormat += ('DTSTART;VALUE=DATE-TIME:%s' %
-                                       dtstart.strftime('%Y%m%dT%H%M%S')
-                                       ) + os.linesep
-                        icalFormat += ('DTEND;VALUE=DATE-TIME:%s' %
-                                       dtend.strftime('%Y%m%dT%H%M%S')
-                                       ) + os.linesep
-                        icalFormat += ('UID:%s' %
-                                       event['guid']) + os.linesep
-                        icalFormat += ('DESCRIPTION:%s' %
-                                       event['description']) + os.linesep
-                        icalFormat += ('URL:%s' %
-                                       event['url']) + os.linesep
-                        icalFormat += ('SUMMARY:%s' %
-                                       event['title']) + os.linesep
-                        icalFormat += ('LOCATION:%s' %
-                                       room) + os.linesep
-                        icalFormat += 'END:VEVENT' + os.linesep
-
-            # Close ical format
-            icalFormat += "END:VCALENDAR"
-
-            # Parse generated ical
-            return icalendar.Calendar.from_ical(icalFormat)
-
-        # Parse xcal format
-        if filetype == 'xcal':
-
-            xmlFormat = xml.etree.ElementTree.fromstring(text)
-
-            # Parse event elements
-            for vevent in xmlFormat.findall('vcalendar/vevent'):
-                icalFormat += 'BEGIN:VEVENT' + os.linesep
-                icalFormat += ('DTSTART;VALUE=DATE-TIME:%s' %
-                               vevent.find('dtstart').text) + os.linesep
-                icalFormat += ('DTEND;VALUE=DATE-TIME:%s' %
-                               vevent.find('dtend').text) + os.linesep
-                icalFormat += ('UID:%s' %
-                               vevent.find('uid').text) + os.linesep
-                icalFormat += ('DESCRIPTION:%s' %
-                               vevent.find('description').text) + os.linesep
-                icalFormat += ('URL:%s' %
-                               vevent.find('url').text) + os.linesep
-                icalFormat += ('SUMMARY:%s' %
-                               vevent.find('summary').text) + os.linesep
-                icalFormat += ('LOCATION:%s' %
-                               vevent.find('location').text) + os.linesep
-                icalFormat += 'END:VEVENT' + os.linesep
-
-            # Close ical format
-            icalFormat += "END:VCALENDAR"
-
-            # Parse generated ical
-            return icalendar.Calendar.from_ical(icalFormat)
+            result = await executor().runCpu(
+                app.caldavParser.parseSyncResponse, response.text
+            )
 
-        print(
-            "[%s] Invalid filetype %s for calendar with id '%s'."
-            % (self.getName(), filetype, calendarConfig['id'])
+            for href in result['removed']:
+                resources.pop(href, None)
+
+            for href, resource in result['changed'].items():
+                # Download resource if report contains only the etag
+                if resource[1] is None:
+                    download = await self._fetch(
+                        urllib.parse.urljoin(calendarConfig['url'], href),
+                        conditional=False,
+                        **self.__getCaldavAuth(calendarConfig)
+                    )
+                    if not download.isModified():
+                        print(
+                            "[%s] Error downloading '%s' of calendar '%s'."
+                            " HTTP status: %d"
+                            % (
+                                self.getName(),
+                                href,
+                                calendarConfig['name'],
+                                download.status
+                            )
+                        )
+                        return False
+                    resource = (
+                        hashlib.sha256(download.text.encode()).hexdigest(),
+                        download.text
+                    )
+                resources[href] = resource
+
+            # Save token only after all changes are applied
+            self.__syncToken[calendarId] = result['syncToken']
+
+            if not result['truncated']:
+                break
+
+        # Hash of calendar from hashes of its resources
+        self.__setCalendarHash(
+            calendarId,
+            hashlib.sha256(
+                '\n'.join(
+                    '%s %s' % (href, resources[href][0])
+                    for href in sorted(resources)
+                ).encode()
+            ).hexdigest()
         )
 
-    def __parseEvents(self, calendarConfig: dict):
+        return True
 
-        # Calculate start and end date
-        start_date = datetime.datetime.now()
+    async def __parseEvents(self, calendarConfig: dict):
+        """ Expand events of calendar for the next days """
+
+        # Calculate start and end date as naive time in timezone of events
+        # independent of system timezone, search may look further ahead
+        start_date = datetime.datetime.now(
+            app.calendarParser.TIMEZONE
+        ).replace(tzinfo=None)
         end_date = \
-            start_date + datetime.timedelta(days=self._config['list_days'])
-
-        # Get events in interval
-        eventsFromIcal = \
-            recurring_ical_events.of(
-                self.__calendar[calendarConfig['id']], components=["VEVENT"]
-            ).between(start_date, end_date)
-
-        # Parse events
-        eventsParsed = []
-        for event in eventsFromIcal:
-
-            # Get start and end date/time
-            dtstart = event.get('DTSTART').dt
-            dtend = event.get('DTEND').dt
-
-            # Convert date to datetime to handle whole day events
-            if type(dtstart) is datetime.date:
-                dtstart = pytz.timezone('Europe/Berlin').localize(
-                    datetime.datetime(
-                        year=dtstart.year,
-                        month=dtstart.month,
-                        day=dtstart.day,
-                        hour=0,
-                        minute=0,
-                        second=0
-                    )
+            start_date + datetime.timedelta(
+                days=max(
+                    self._config['list_days'],
+                    self._config['search_days'] or 0
                 )
+            )
 
-            if type(dtend) is datetime.date:
-                dtend = pytz.timezone('Europe/Berlin').localize(
-                    datetime.datetime(
-                        year=dtend.year,
-                        month=dtend.month,
-                        day=dtend.day,
-                        hour=0,
-                        minute=0,
-                        second=0
-                    )
+        try:
+            _, expandedEnd = \
+                self.__eventsInterval[calendarConfig['id']]
+        except KeyError:
+            expandedEnd = None
+
+        if expandedEnd is None or expandedEnd <= start_date:
+            # Expand whole interval for new or changed calendar
+            events = await self.__expandEvents(
+                calendarConfig, start_date, end_date
+            )
+            self.__searchIndex[calendarConfig['id']] = {}
+            self.__indexEvents(calendarConfig['id'], events)
+        else:
+            # Drop finished events and expand only the new part of interval
+            now = time.time()
+            events = []
+            finishedEvents = []
+            for event in self.__events[calendarConfig['id']]:
+                if event.end > now:
+                    events.append(event)
+                else:
+                    finishedEvents.append(event)
+            expandedEndTimestamp = \
+                pytz.timezone('Europe/Berlin').localize(expandedEnd) \
+                .timestamp()
+            newEvents = [
+                event
+                for event in await self.__expandEvents(
+                    calendarConfig, expandedEnd, end_date
                 )
+                # Events overlapping the old end are already included
+                if event.start >= expandedEndTimestamp
+            ]
+            events += newEvents
+
+            # Update search index only for changed events
+            self.__unindexEvents(calendarConfig['id'], finishedEvents)
+            self.__indexEvents(calendarConfig['id'], newEvents)
+
+        # Render output once for new events
+        for event in events:
+            if event.output is None:
+                event.output = self.__formatOutput(event)
+
+        self.__events[calendarConfig['id']] = events
+        self.__eventsInterval[calendarConfig['id']] = (start_date, end_date)
+
+    def __getTokens(self, event: app.calendarParser.calendarEvent) -> set:
+        """ Get search tokens of summary, location and description """
+        return set(
+            itertools.chain.from_iterable(
+                re.findall(r'\w+', text.lower())
+                for text in (event.summary, event.location, event.description)
+                if text is not None
+            )
+        )
 
-            # Localize start and end
-            dtstart = dtstart.astimezone(pytz.timezone('Europe/Berlin'))
-            dtend = dtend.astimezone(pytz.timezone('Europe/Berlin'))
-
-            # Add event to parsed events
-            eventsParsed.append({
-                'calendar_id': calendarConfig['id'],
-                'start': dtstart,
-                'end': dtend,
-                'summary': event.get('SUMMARY'),
-                'location': event.get('LOCATION'),
-                'description': event.get('DESCRIPTION'),
-            })
-
-        eventsParsed = sorted(
-            eventsParsed,
-            key=lambda c: c['start'],
-            reverse=False
+    def __indexEvents(self, calendarId: str, events: list):
+        """ Add events to search index of calendar """
+        searchIndex = self.__searchIndex.setdefault(calendarId, {})
+        for event in events:
+            for token in self.__getTokens(event):
+                searchIndex.setdefault(token, set()).add(event)
+
+    def __unindexEvents(self, calendarId: str, events: list):
+        """ Remove events from search index of calendar """
+        searchIndex = self.__searchIndex.setdefault(calendarId, {})
+        for event in events:
+            for token in self.__getTokens(event):
+                tokenEvents = searchIndex.get(token)
+                if tokenEvents is None:
+                    continue
+                tokenEvents.discard(event)
+                if len(tokenEvents) == 0:
+                    del searchIndex[token]
+
+    def __search(self, terms: str) -> str:
+        """ Search upcoming events of all calendars containing all terms """
+        tokens = set(re.findall(r'\w+', terms.lower()))
+        if len(tokens) == 0:
+            return "Please provide search terms for !dates search"
+
+        # Intersect events of all tokens, starting with the rarest token
+        found = None
+        for calendarIndex in self.__searchIndex.values():
+            postings = sorted(
+                (calendarIndex.get(token, set()) for token in tokens),
+                key=len
+            )
+            calendarFound = set(postings[0]).intersection(*postings[1:])
+            found = calendarFound if found is None else found | calendarFound
+
+        now = time.time()
+        events = sorted(
+            (event for event in found or [] if event.end > now),
+            key=lambda c: c.start
         )
 
-        self.__events[calendarConfig['id']] = eventsParsed
-        return
+        if len(events) == 0:
+            return "No upcoming events found for \"%s\"" % terms
 
-    def __getAnnounceIntervalsByCalendarIds(self, calendarIds: list) -> list:
-        """ Get individual or global announce intervals """
+        output = "Found %d upcoming event(s) for \"%s\":" % (
+            len(events), terms
+        )
+        for event in events[0:self._config['search_limit']]:
+            output += "\n"
+            output += event.output
+        if len(events) > self._config['search_limit']:
+            output += "\n(%d more)" % (
+                len(events) - self._config['search_limit']
+            )
 
-        # Create initial dict for interval summary
-        announceIntervals = {
-            "__all": []
-        }
+        return output
+
+    async def __expandEvents(
+            self, calendarConfig: dict,
+            start_date: datetime.datetime,
+            end_date: datetime.datetime) -> list:
+        """ Get sorted events of calendar in interval from process pool
 
-        for calendarId in calendarIds:
+        Workers keep parsed calendars by content hash, so texts are only
+        sent after a worker reported them missing.
+        """
+        calendarId = calendarConfig['id']
+        sent = set()
+        while True:
             try:
-                announceIntervalsByCalendarId = \
-                    self.__calendarConfig[calendarId]['announce_interval']
-                # Ensure announce interval is a list
-                if not type(announceIntervalsByCalendarId) is list:
-                    announceIntervalsByCalendarId = \
-                        [announceIntervalsByCalendarId]
-
-                announceIntervals['__all'] += announceIntervalsByCalendarId
-                announceIntervals[calendarId] = \
-                    sorted(announceIntervalsByCalendarId)
-            except KeyError:
-                # Use global interval due to missing individual configuration
-                announceIntervals['__all'] += self._config['announce_interval']
-                announceIntervals[calendarId] = \
-                    sorted(self._config['announce_interval'])
-
-        # Consolidate announce interval summary
-        announceIntervals['__all'] = \
-            sorted(list(set(announceIntervals['__all'])))
-
-        return announceIntervals
+                if calendarConfig.get('type', 'ical') == 'caldav':
+                    return await executor().runCpu(
+                        app.calendarParser.expandResources,
+                        calendarId,
+                        [
+                            (textHash, text if textHash in sent else None)
+                            for textHash, text
+                            in self.__calendarText[calendarId].values()
+                        ],
+                        start_date,
+                        end_date,
+                        self._config['cache_limit']
+                    )
+
+                return await executor().runCpu(
+                    app.calendarParser.expandCalendar,
+                    calendarId,
+                    calendarConfig.get('type', 'ical'),
+                    self.__calendarText[calendarId]
+                    if self.__calendarHash[calendarId] in sent else None,
+                    self.__calendarHash[calendarId],
+                    start_date,
+                    end_date,
+                    self._config['cache_limit']
+                )
+            except app.calendarParser.calendarCacheMiss as e:
+                # Texts were sent already, should never happen
+                if sent.issuperset(e.hashes):
+                    raise
+
+                sent.update(e.hashes)
+
+    def __getChanges(self, calendarConfig: dict) -> list:
+        """ Diff events against last snapshot and save new snapshot """
+        calendarId = calendarConfig['id']
+        snapshot = self.__snapshot.get(calendarId)
+
+        # Events can only change with content
+        if snapshot is not None and \
+                snapshot['hash'] == self.__calendarHash[calendarId]:
+            return []
+
+        # Index events by uid and recurrence id
+        events = {
+            event.getKey(): event
+            for event in self.__events[calendarId]
+            if event.uid is not None
+        }
+
+        _, expandedEnd = self.__eventsInterval[calendarId]
+        self.__snapshot[calendarId] = {
+            'hash': self.__calendarHash[calendarId],
+            'until':
+                pytz.timezone('Europe/Berlin').localize(expandedEnd)
+                .timestamp(),
+            'events': {
+                key: [event.start, event.end, event.summary, event.location]
+                for key, event in events.items()
+            },
+        }
+        self._setState('snapshot', self.__snapshot)
+
+        # Nothing to compare on first refresh
+        if snapshot is None:
+            return []
+
+        now = time.time()
+        changes = []
+        for key, (start, end, summary, location) in \
+                snapshot['events'].items():
+            # Finished events are not in current events anymore
+            if end <= now:
+                continue
+
+            event = events.get(key)
+            if event is None:
+                changes.append((
+                    start,
+                    "Cancelled: %s" % self.__formatOutput(
+                        app.calendarParser.calendarEvent(
+                            calendarId, start, end, summary, location
+                        )
+                    )
+                ))
+            elif event.start != start or event.end != end:
+                changes.append((
+                    event.start,
+                    "Moved: %s (previously %s)" % (
+                        event.output,
+                        datetime.datetime.fromtimestamp(
+                            start, pytz.timezone('Europe/Berlin')
+                        ).strftime(self._config['format']['datetime'])
+                    )
+                ))
+
+        for key, event in events.items():
+            # Events after the last interval are not added but upcoming
+            if key not in snapshot['events'] and \
+                    event.start < snapshot['until']:
+                changes.append((event.start, "Added: %s" % event.output))
+
+        return [change for _, change in sorted(changes)]
+
+    async def __announceChanges(self, calendarConfig: dict):
+        """ Announce changed events in rooms of calendar """
+        changes = self.__getChanges(calendarConfig)
+        if len(changes) == 0:
+            return
+
+        print(
+            "[%s] Found %d changes in calendar '%s'"
+            % (self.getName(), len(changes), calendarConfig['name'])
+        )
+
+        joinedRoomIds = self._getJoinedRoomIds()
+        for roomId in calendarConfig.get('rooms', []):
+            if roomId not in joinedRoomIds:
+                continue
+
+            await self._sendMessage(
+                "Changes in calendar %s:\n%s"
+                % (calendarConfig['name'], "\n".join(changes)),
+                roomId=roomId,
+                messageType="notice"
+            )
+
+    def __getAnnounceIntervals(self, calendarId: str) -> list:
+        """ Get individual or global announce intervals of calendar """
+        try:
+            announceIntervals = \
+                self.__calendarConfig[calendarId]['announce_interval']
+            # Ensure announce interval is a list
+            if not type(announceIntervals) is list:
+                announceIntervals = [announceIntervals]
+        except KeyError:
+            # Use global interval due to missing individual configuration
+            announceIntervals = self._config['announce_interval']
+
+        return sorted(announceIntervals)
+
+    def __getCurrentMinute(self) -> int:
+        """ Get timestamp of current minute without seconds """
+        return int(time.time()) // 60 * 60
+
+    def __buildTimeline(self):
+        """ Precompute announcements of all calendars after refresh """
+        timeline = []
+        for calendarId, calendarConfig in self.__calendarConfig.items():
+            for announceInterval in self.__getAnnounceIntervals(calendarId):
+                for event in self.__events.get(calendarId, []):
+                    fireTime = event.start - announceInterval * 60
+
+                    # Skip announcements already done
+                    if fireTime <= self.__announcedUntil:
+                        continue
+
+                    for roomId in calendarConfig.get('rooms', []):
+                        timeline.append((
+                            fireTime,
+                            announceInterval,
+                            len(timeline),
+                            roomId,
+                            event
+                        ))
+
+        heapq.heapify(timeline)
+        self.__timeline = timeline
 
     def __isAnnounceLocation(self, calendarId: str) -> bool:
         """ Return if calendar should announce location """
@@ -338,32 +681,32 @@ class dates(app.plugin.plugin):
             Dates during the next days
         """
 
+        # Search events
+        if parameter is not None and \
+                parameter.split(' ', 1)[0] == "search":
+            return self.__search(parameter[len("search"):].strip())
+
+        # Get precomputed events
         if parameter is None:
-            calendarIds = self._getIdsByRoomId('calendar', roomId)
+            events = self.__eventsIndex.get(roomId, [])
         elif parameter == "all":
-            calendarIds = self._getIds('calendar')
-        elif parameter in self._getIds('calendar'):
-            calendarIds = [parameter]
+            events = self.__eventsIndex.get('__all', [])
+        elif parameter in self.__calendarConfig:
+            events = self.__getLimitedEvents(parameter)
         else:
             return "Invalid parameter for !dates"
 
-        # Get all events for calendar ids
-        eventsMerged = self.__mergeAndSortEvents(
-            calendarIds
-        )
-
-        if len(eventsMerged) >= 1:
+        if len(events) >= 1:
             # Events found
             output = "Please notice the next following event(s):"
-            for event in eventsMerged:
+            for event in events:
                 output += "\n"
-                output += self.__formatOutput(event)
+                output += event.output
         else:
             # No event found
             output = \
                 "No dates during the next %d days" % self._config['list_days']
 
-        del eventsMerged
         return output
 
     def help(self, controlsign: str, roomId: str):
@@ -376,7 +719,7 @@ class dates(app.plugin.plugin):
         )
 
         # Get calendars used in this room
-        calendarIdsRoom = self._getIdsByRoomId('calendar', roomId)
+        calendarIdsRoom = self.__calendarIdsByRoom.get(roomId, [])
 
         # Get max length of calendar ids or "CALENDAR-ID"
         idMaxLength = max(11, len(max(self.__calendarConfig, key=len)))+1
@@ -387,7 +730,10 @@ class dates(app.plugin.plugin):
             "\"%sdates CALENDAR-ID\".\n" % controlsign
         output += \
             "To get a combination from all calendars " \
-            "use \"%sdates all\".\n\n" % controlsign
+            "use \"%sdates all\".\n" % controlsign
+        output += \
+            "To search upcoming events " \
+            "use \"%sdates search TERMS\".\n\n" % controlsign
         output += "%s | NAME" % 'CALENDAR-ID'.rjust(idMaxLength, ' ')
         for calendar in calendarConfig:
             outputExtend = []
@@ -414,114 +760,99 @@ class dates(app.plugin.plugin):
     async def __announce(self):
         """ Announce upcoming evens """
 
-        # Get current date and time without (micro)seconds
-        now = pytz.timezone('Europe/Berlin').localize(
-            datetime.datetime.now().replace(second=0, microsecond=0)
-        )
-
-        # Announce dates by joined rooms
-        for roomId in (await self._getJoinedRoomIds()):
-
-            # Get events for room id
-            events = self.__mergeAndSortEvents(
-                calendarIds=self._getIdsByRoomId('calendar', roomId),
-                ignoreLimit=True
-            )
-
-            # Get all announceIntervals
-            announceIntervals = \
-                self.__getAnnounceIntervalsByCalendarIds(
-                    self._getIdsByRoomId('calendar', roomId)
-                )
-
-            # Generate output
-            output = []
-            for announceInterval in announceIntervals['__all']:
-
-                # Loop events to find starting exactly after interval
-                for event in events:
-
-                    # Skip event if interval is not configured for calendar
-                    if announceInterval not in \
-                            announceIntervals[event['calendar_id']]:
-                        continue
-
-                    # Calculate datetime from now and interval
-                    then = now + datetime.timedelta(minutes=announceInterval)
+        now = self.__getCurrentMinute()
 
-                    # Event found starting exactly after announce interval
-                    if event['start'] == then:
-                        output.append(self.__formatOutput(event))
+        # Collect due announcements, including missed ones of late runs
+        output = {}
+        while len(self.__timeline) > 0 and self.__timeline[0][0] <= now:
+            _, _, _, roomId, event = heapq.heappop(self.__timeline)
+            output.setdefault(roomId, []).append(event.output)
+        self.__announcedUntil = max(self.__announcedUntil, now)
 
-                    # Ignore sorted events if start is after interval
-                    if event['start'] > then:
-                        break
+        # Announce dates in joined rooms
+        joinedRoomIds = self._getJoinedRoomIds()
+        for roomId, roomOutput in output.items():
+            if roomId not in joinedRoomIds:
+                continue
 
             # Output single event
-            if len(output) == 1:
+            if len(roomOutput) == 1:
                 await self._sendMessage(
-                    "Upcoming event: %s" % output[0],
+                    "Upcoming event: %s" % roomOutput[0],
                     roomId=roomId,
                     messageType="notice"
                 )
             # Output multiple events
-            elif len(output) > 1:
+            else:
                 await self._sendMessage(
-                    "Upcoming events:\n%s" % "\n".join(output),
+                    "Upcoming events:\n%s" % "\n".join(roomOutput),
                     roomId=roomId,
                     messageType="notice"
                 )
 
-    def __mergeAndSortEvents(
-            self, calendarIds: list, ignoreLimit: bool = False) -> list:
-        """ Merge and sort events based on a list of calendar Ids """
-
-        eventsMerged = []
-        for calendarId in calendarIds:
+    def __getLimitedEvents(self, calendarId: str) -> list:
+        """ Get events of calendar within list_days and limit_entries """
+        listEnd = time.time() + self._config['list_days'] * 86400
+        events = itertools.takewhile(
+            lambda c: c.start < listEnd,
+            self.__events.get(calendarId, [])
+        )
+        return list(
+            itertools.islice(
+                events,
+                self.__calendarConfig[calendarId].get('limit_entries')
+            )
+        )
 
-            # Get events for calendar
-            if ignoreLimit:
-                # Ignore Limit
-                eventsMerged += self.__events[calendarId]
-            else:
-                # Shorten event list (if limit_entries configured)
-                try:
-                    eventsMerged += \
-                        self.__events[calendarId][
-                            0:
-                            self.__calendarConfig[calendarId]['limit_entries']
-                        ]
-                except KeyError:
-                    eventsMerged += self.__events[calendarId]
-
-        # Resort by datetime
-        eventsMerged = sorted(
-            eventsMerged,
-            key=lambda c: c['start'],
-            reverse=False
+    def __mergeEvents(self, calendarIds: list) -> list:
+        """ Merge sorted and limited events of calendars """
+        return list(
+            heapq.merge(
+                *[
+                    self.__getLimitedEvents(calendarId)
+                    for calendarId in calendarIds
+                ],
+                key=lambda c: c.start
+            )
         )
 
-        return eventsMerged
+    def __buildIndex(self):
+        """ Precompute merged events by room and for all calendars """
+        eventsIndex = {
+            roomId: self.__mergeEvents(calendarIds)
+            for roomId, calendarIds in self.__calendarIdsByRoom.items()
+        }
+        eventsIndex['__all'] = \
+            self.__mergeEvents(self.__calendarConfig.keys())
+        self.__eventsIndex = eventsIndex
 
-    def __formatOutput(self, event: dict) -> str:
+    def __formatOutput(
+            self, event: app.calendarParser.calendarEvent) -> str:
         """ Format output """
+        start = datetime.datetime.fromtimestamp(
+            event.start, pytz.timezone('Europe/Berlin')
+        )
+        end = datetime.datetime.fromtimestamp(
+            event.end, pytz.timezone('Europe/Berlin')
+        )
+
         output = \
             "%s - %s" % (
-                event['start'].strftime(
+                start.strftime(
                     self._config['format']['datetime']
                 ),
-                event['summary']
+                event.summary
             )
 
-        if event['end'].date() > event['start'].date():
+        if end.date() > start.date():
             output += \
                 " (until %s)" % (
-                    event['end'].strftime(
+                    end.strftime(
                         self._config['format']['datetime']
                     )
                 )
 
-        if self.__isAnnounceLocation(event['calendar_id']):
-            output += " (%s)" % event['location']
+        if self.__isAnnounceLocation(event.calendarId):
+            output += " (%s)" % event.location
 
         return output
@@ -1,6 +1,4 @@
-import aiocron
 # import aiohttp
-import asyncio
 import datetime
 # import json
 import pytz
@@ -11,6 +9,8 @@ from deutschland.nina.exceptions import ApiException, NotFoundException
 
 import app.plugin
 from app.config import config
+from app.executor import executor
+from app.messageQueue import messageQueue
 
 
 class mowas(app.plugin.plugin):
@@ -109,6 +109,9 @@ class mowas(app.plugin.plugin):
     # Mowas messages
     __mowas = {}
 
+    # Timestamps of last announced warnings by location id
+    __published = {}
+
     def __init__(self, matrixApi):
         """Start base class constructor"""
         try:
@@ -131,19 +134,24 @@ class mowas(app.plugin.plugin):
         # Get location configurations as dictionary
         self.__locationConfig = self._getConfigList('locations')
 
-        # Get mowas messages once and refresh by cron
-        asyncio.get_event_loop().run_until_complete(self.__getLocations())
-        aiocron.crontab('* * * * *', func=self.__getLocations)
+        # Refresh mowas messages every minute
+        self._addJob(
+            'refresh', self.__getLocations, cron='* * * * *', jitter=15
+        )
+
+    async def startup(self):
+        """Get mowas messages once"""
+        await self.__getLocations()
 
     def __configCheck(self):
         """ Check default configuration for locations """
+        self.__published = self._getState('published', {})
         for location in self._config['locations']:
-            # Set last published to current timestamp if empty
-            try:
-                location['published']
-            except KeyError:
-                location['published'] = \
-                    int(datetime.datetime.now().timestamp())
+            # Set last published from config or to current timestamp
+            if location['id'] not in self.__published:
+                self.__published[location['id']] = location.get(
+                    'published', int(datetime.datetime.now().timestamp())
+                )
 
     async def __getLocations(self):
         """ Get mowas messages for all locations """
@@ -164,12 +172,12 @@ class mowas(app.plugin.plugin):
                 )
             )
 
-            # Run async threads for update
-            thread = \
-                self.__mowasWarningsApi.get_dashboard(
-                    str(locationConfig['ars']), async_req=True
-                )
-            self.__mowas[locationConfig['id']] = thread.get().get('value')
+            # Run blocking API call in thread pool
+            dashboard = await executor().runBlocking(
+                self.__mowasWarningsApi.get_dashboard,
+                str(locationConfig['ars'])
+            )
+            self.__mowas[locationConfig['id']] = dashboard.get('value')
 
             # Sort warnings by sent date descendant
             self.__mowas[locationConfig['id']] = sorted(
@@ -220,7 +228,7 @@ class mowas(app.plugin.plugin):
             if announce is True:
                 published = pytz.timezone('Europe/Berlin').localize(
                     datetime.datetime.fromtimestamp(
-                        self.__locationConfig[locationId]['published']
+                        self.__published[locationId]
                     )
                 )
 
@@ -233,8 +241,9 @@ class mowas(app.plugin.plugin):
 
                 # Set published to latest (first) warning on announcement
                 if announce is True and warningIndex == 0:
-                    self.__locationConfig[locationId]['published'] = \
+                    self.__published[locationId] = \
                         int(warning['sent'].timestamp())
+                    self._setState('published', self.__published)
 
                 # Ignore highwater or weather
                 if (
@@ -258,9 +267,6 @@ class mowas(app.plugin.plugin):
             output = \
                 "No warnings available"
 
-        if announce is True:
-            self._setConfig()
-
         return output
 
     def help(self, controlsign: str, roomId: str):
@@ -313,7 +319,7 @@ class mowas(app.plugin.plugin):
         )
 
         # Announce warnings by joined roooms
-        for roomId in (await self._getJoinedRoomIds()):
+        for roomId in self._getJoinedRoomIds():
 
             output = \
                 await self.mowas(parameter=None, roomId=roomId, announce=True)
@@ -322,7 +328,8 @@ class mowas(app.plugin.plugin):
                 await self._sendMessage(
                     output,
                     roomId=roomId,
-                    messageType="html"
+                    messageType="html",
+                    priority=messageQueue.PRIORITY_HIGH
                 )
 
     def __formatOutput(
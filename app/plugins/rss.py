@@ -1,13 +1,14 @@
-import aiocron
-import aiohttp
 import asyncio
+import collections
 import datetime
-import feedparser
-import random
 import time
 
+import app.feedParser
 import app.plugin
 from app.config import config
+from app.executor import executor
+from app.httpClient import httpResponse
+from app.messageQueue import messageQueue
 
 
 class rss(app.plugin.plugin):
@@ -29,16 +30,59 @@ class rss(app.plugin.plugin):
             'merged': 1,
             'single': 3,
         },
+        'refresh_concurrency': 4,
+        'refresh_timeout': 60,
+        'seen_limit': 1000,
+        'max_entries': 50,
+        'stream': False,
+        'max_size': 10485760,
+        'adaptive': False,
+        'min_interval': 300,
+        'max_interval': 21600,
     }
 
+    # Feeds are refreshed on startup
+    _refreshSources = 'feeds'
+
     # Required configuration values
     _configRequired = [
         'feeds',
     ]
 
-    # RSS objects
+    # Parsed entries (feedEntry) by feed id
     __rss = {}
 
+    # Timestamps of last announced entries by feed id from config, only
+    # used until the first seen entries of a feed are saved
+    __published = {}
+
+    # Update timestamps of seen entries by guid and feed id, least
+    # recently seen first
+    __seen = {}
+
+    # Number of failed refreshes in a row by feed id
+    __failures = {}
+
+    # Timestamps until failing feeds are skipped by feed id
+    __retryAfter = {}
+
+    # Backoff for failing feeds in seconds
+    __backoffBase = 300
+    __backoffMax = 21600
+
+    # Learned refresh intervals in seconds by feed id (adaptive feeds)
+    __pollInterval = {}
+
+    # Timestamps of next refresh by feed id (adaptive feeds)
+    __nextPoll = {}
+
+    # Feeds due within this number of seconds are refreshed in the
+    # current run of the adaptive job
+    __pollTolerance = 60
+
+    # Number of latest entry timestamps used to learn update rate
+    __pollSamples = 10
+
     def __init__(self, matrixApi):
         """Start base class constructor"""
         try:
@@ -50,42 +94,68 @@ class rss(app.plugin.plugin):
         # Configuration check for feeds
         self.__configCheck()
 
-        # Get all RSS feeds once
-        asyncio.get_event_loop().run_until_complete(self.__getRss())
-
-        # Initialize crons to refresh RSS feeds
-        feedIdsDefaultCron = []
+        # Initialize jobs to refresh RSS feeds
+        feedIdsDefaultJob = []
+        feedIdsAdaptiveJob = []
         for feed in self._config['feeds']:
             if 'cron' in feed:
-                # Feed has cron definition, so run as seperate cron
-                aiocron.crontab(
-                    feed['cron'],
-                    func=self.__getRss,
+                # Feed has cron definition, so run as seperate job
+                self._addJob(
+                    'refresh.%s' % feed['id'],
+                    self.__getRss,
+                    cron=feed['cron'],
+                    jitter=60,
                     args=(True, [feed['id']])
                 )
+            elif self.__isAdaptive(feed):
+                # collect feed ids with learned refresh interval
+                feedIdsAdaptiveJob.append(feed['id'])
             else:
                 # collect feed ids without cron definition
-                feedIdsDefaultCron.append(feed['id'])
-
-        # Run collected feed ids in standard cron every 15 minutes
-        if len(feedIdsDefaultCron) > 0:
-            randomMinute = random.randint(0, 14)
-            aiocron.crontab(
-                '%s/15 * * * *' % randomMinute,
-                func=self.__getRss,
-                args=(True, feedIdsDefaultCron)
+                feedIdsDefaultJob.append(feed['id'])
+
+        # Run collected feed ids every 15 minutes
+        if len(feedIdsDefaultJob) > 0:
+            self._addJob(
+                'refresh',
+                self.__getRss,
+                interval=900,
+                args=(True, feedIdsDefaultJob)
             )
 
-        del feedIdsDefaultCron
+        # Check adaptive feeds with their shortest interval, feeds are
+        # only refreshed if due
+        if len(feedIdsAdaptiveJob) > 0:
+            self._addJob(
+                'refresh.adaptive',
+                self.__getRss,
+                interval=min(
+                    feed.get('min_interval', self._config['min_interval'])
+                    for feed in self._config['feeds']
+                    if feed['id'] in feedIdsAdaptiveJob
+                ),
+                args=(True, feedIdsAdaptiveJob)
+            )
+
+        del feedIdsDefaultJob
+        del feedIdsAdaptiveJob
+
+    async def startup(self):
+        """Get all RSS feeds once"""
+        await self.__getRss()
 
     def __configCheck(self):
         """ Check default configuration for feeds """
+        self.__seen = {
+            feedId: collections.OrderedDict(seen)
+            for feedId, seen in self._getState('seen', {}).items()
+        }
+        self.__published = {}
         for feed in self._config['feeds']:
-            # Set last published to current timestamp if empty
-            try:
-                feed['published']
-            except KeyError:
-                feed['published'] = int(datetime.datetime.now().timestamp())
+            # Set last published from config or to current timestamp
+            self.__published[feed['id']] = feed.get(
+                'published', int(datetime.datetime.now().timestamp())
+            )
             # Set summarize treshold to 0 (disabled) if empty
             try:
                 feed['summarize']
@@ -137,9 +207,9 @@ class rss(app.plugin.plugin):
             for x in range(0, feedEntryCount):
                 try:
                     output += self.__formatOutput(
-                         feed, self.__rss[feed['id']].entries[x]
+                         feed, self.__rss[feed['id']][x]
                          )
-                except IndexError:
+                except (IndexError, KeyError):
                     pass
                 if x <= feedEntryCount:
                     output += "\n"
@@ -182,18 +252,52 @@ class rss(app.plugin.plugin):
 
         return output
 
-    def __getRssEntryPublished(self, feedId: str, entryId):
+    def __getNewEntries(self, feedId: str) -> list:
+        """ Get new or updated entries and mark all entries as seen """
+        entries = self.__rss[feedId]
+        seen = self.__seen.get(feedId)
 
-        return \
-            int(
-                datetime.datetime.fromtimestamp(
-                    time.mktime(
-                        self.__rss[feedId].entries[entryId].published_parsed
-                    ),
-                    datetime.timezone.utc
-                ).timestamp()
+        if seen is None:
+            # Use timestamp of last announced entry on first run
+            newEntries = [
+                entry
+                for entry in entries
+                if entry.published > self.__published[feedId]
+            ]
+            seen = self.__seen[feedId] = collections.OrderedDict()
+            changed = True
+        else:
+            newEntries = [
+                entry
+                for entry in entries
+                if entry.guid not in seen
+                # Entry was edited since it was seen
+                or entry.updated > seen[entry.guid]
+            ]
+            changed = len(newEntries) > 0 or any(
+                seen.get(entry.guid) != entry.updated for entry in entries
             )
 
+        # Mark all entries in feed as recently seen
+        for entry in reversed(entries):
+            seen[entry.guid] = entry.updated
+            seen.move_to_end(entry.guid)
+
+        # Forget least recently seen entries, keep entries still in feed
+        while len(seen) > max(self._config['seen_limit'], len(entries)):
+            seen.popitem(last=False)
+
+        if changed:
+            self._setState(
+                'seen',
+                {
+                    feedId: dict(feedSeen)
+                    for feedId, feedSeen in self.__seen.items()
+                }
+            )
+
+        return newEntries
+
     async def __announce(self, feedIds: list = None):
 
         # Check all feeds
@@ -203,8 +307,8 @@ class rss(app.plugin.plugin):
             if feedIds is not None and feed['id'] not in feedIds:
                 continue
 
-            # No new entry
-            if self.__getRssEntryPublished(feed['id'], 0) <= feed['published']:
+            # No parsed or empty feed
+            if len(self.__rss.get(feed['id'], [])) == 0:
                 continue
 
             # No rooms to auto announce, skip feed
@@ -212,14 +316,11 @@ class rss(app.plugin.plugin):
                 continue
 
             # Get new entries
-            entries = [
-                entry
-                for x, entry in enumerate(self.__rss[feed['id']].entries)
-                if (
-                    self.__getRssEntryPublished(feed['id'], x) >
-                    feed['published']
-                )
-            ]
+            entries = self.__getNewEntries(feed['id'])
+
+            # No new entry
+            if len(entries) == 0:
+                continue
 
             # Generate output for entries
             output = ""
@@ -234,11 +335,6 @@ class rss(app.plugin.plugin):
                 if x > 0:
                     output += "\n"
 
-            # Set last published to latest entry and save config
-            feed['published'] = \
-                self.__getRssEntryPublished(feed['id'], 0)
-            self._setConfig()
-
             # Add header and footer for summarize
             if (feed['summarize']['treshold'] != 0 and
                     len(entries) > feed['summarize']['treshold']):
@@ -254,38 +350,225 @@ class rss(app.plugin.plugin):
 
             # Announce message in rooms
             for roomId in feed['rooms']:
-                await self._sendMessage(output, roomId, messageType="notice")
+                await self._sendMessage(
+                    output,
+                    roomId,
+                    messageType="notice",
+                    priority=messageQueue.PRIORITY_LOW
+                )
 
     async def __getRss(self, announce: bool = True, feedIds: list = None):
+        """Get and parse latest RSS feeds concurrently"""
+        feeds = [
+            feed
+            for feed in self._config['feeds']
+            # check if feed id list is not empty and id in list
+            if (feedIds is None or feed['id'] in feedIds)
+            # skip adaptive feeds not due yet
+            and self.__nextPoll.get(feed['id'], 0)
+            <= time.time() + self.__pollTolerance
+            # skip failing feeds until backoff is over
+            and self.__retryAfter.get(feed['id'], 0) <= time.time()
+        ]
+
+        # Nothing to do in most runs of the adaptive job
+        if len(feeds) == 0:
+            return
+
+        semaphore = asyncio.Semaphore(self._config['refresh_concurrency'])
+        results = await asyncio.gather(
+            *[self.__getFeedLimited(semaphore, feed) for feed in feeds]
+        )
 
-        """Get and parse latest RSS feeds"""
-        for feed in self._config['feeds']:
+        print(
+            "[%s] Refreshed %d of %d RSS feeds"
+            % (self.getName(), results.count(True), len(results))
+        )
 
-            # check if feed id list is not empty and id in list
-            if feedIds is not None and feed['id'] not in feedIds:
-                continue
+        # Announce new entries of refreshed feeds
+        if announce:
+            await self.__announce(feedIds=[feed['id'] for feed in feeds])
+
+    async def __getFeedLimited(
+            self, semaphore: asyncio.Semaphore, feed: dict) -> bool:
+        """Get feed limited by concurrency and timeout, count failures"""
+
+        # Remember latest entry to detect changes
+        try:
+            latestGuid = self.__rss[feed['id']][0].guid
+        except (KeyError, IndexError):
+            latestGuid = None
+
+        success = await self._refreshLimited(
+            semaphore,
+            "RSS feed for %s" % feed['name'],
+            self.__getFeed,
+            feed
+        )
+
+        if success:
+            self.__failures.pop(feed['id'], None)
+            self.__retryAfter.pop(feed['id'], None)
+
+            if self.__isAdaptive(feed):
+                try:
+                    changed = \
+                        self.__rss[feed['id']][0].guid != latestGuid
+                except (KeyError, IndexError):
+                    changed = False
+                self.__updatePollInterval(feed, changed)
+        else:
+            # Delay next refresh of failing feed exponentially
+            self.__failures[feed['id']] = \
+                self.__failures.get(feed['id'], 0) + 1
+            backoff = min(
+                self.__backoffBase * 2 ** (self.__failures[feed['id']] - 1),
+                self.__backoffMax
+            )
+            self.__retryAfter[feed['id']] = time.time() + backoff
+            print(
+                "[%s] RSS feed for %s failed %d times, next try in %d "
+                "seconds"
+                % (
+                    self.getName(),
+                    feed['name'],
+                    self.__failures[feed['id']],
+                    backoff
+                )
+            )
+
+        return success
+
+    def __isAdaptive(self, feed: dict) -> bool:
+        """ Return if refresh interval of feed is learned """
+        return 'cron' not in feed and \
+            feed.get('adaptive', self._config['adaptive'])
+
+    def __updatePollInterval(self, feed: dict, changed: bool):
+        """Learn refresh interval of feed from its update rate
+
+        The interval is half the average time between the latest entries,
+        or half the time since the latest entry while the feed is quiet.
+        Unchanged responses (304 or same latest entry) stretch the
+        interval, feeds without timestamps only learn from changes.
+        """
+        minInterval = feed.get('min_interval', self._config['min_interval'])
+        maxInterval = feed.get('max_interval', self._config['max_interval'])
+        previous = self.__pollInterval.get(feed['id'], minInterval)
+        now = time.time()
+
+        published = sorted(
+            (
+                entry.published
+                for entry in self.__rss.get(feed['id'], [])
+                if entry.published > 0
+            ),
+            reverse=True
+        )[0:self.__pollSamples]
+
+        if len(published) > 1:
+            interval = max(
+                (published[0] - published[-1]) / (len(published) - 1),
+                now - published[0]
+            ) / 2
+            if not changed:
+                interval = max(interval, previous * 1.5)
+        elif changed:
+            interval = previous / 2
+        else:
+            interval = previous * 1.5
+
+        self.__pollInterval[feed['id']] = \
+            min(max(interval, minInterval), maxInterval)
+        self.__nextPoll[feed['id']] = now + self.__pollInterval[feed['id']]
 
-            # Refresh RSS feed
-            async with aiohttp.ClientSession() as session:
-                async with session.get(feed['url']) as response:
-                    print(
-                        "[%s] Refreshing RSS feed for %s from %s"
-                        % (self.getName(), feed['name'], feed['url'])
+    async def __getFeed(self, feed: dict) -> bool:
+        """Get and parse RSS feed and return if refresh was successful"""
+        try:
+            print(
+                "[%s] Refreshing RSS feed for %s from %s"
+                % (self.getName(), feed['name'], feed['url'])
+            )
+            if feed.get('stream', self._config['stream']):
+                response = await self.__streamFeed(feed)
+            else:
+                response = await self._fetch(
+                    feed['url'],
+                    conditional=(feed['id'] in self.__rss),
+                    key=feed['id']
+                )
+                if response.isModified():
+                    # Parse in process pool to keep event loop responsive
+                    self.__rss[feed['id']] = await executor().runCpu(
+                        app.feedParser.parseFeed,
+                        response.text,
+                        feed.get('max_entries', self._config['max_entries'])
                     )
-                    if response.status == 200:
-                        self.__rss[feed['id']] = \
-                            feedparser.parse(await response.text())
-                    else:
-                        print(
-                            "[%s] Error downloading RSS feed. HTTP status: %d"
-                            % (self.getName(), response.status)
-                        )
-
-        # Announce new entries after updating RSS feed
-        if announce:
-            await self.__announce(feedIds=feedIds)
+                    self._saveValidators(response, feed['id'])
+
+            if not response.isModified() and not response.isNotModified():
+                print(
+                    "[%s] Error downloading RSS feed for %s. HTTP status: %d"
+                    % (self.getName(), feed['name'], response.status)
+                )
+
+            return response.isModified() or response.isNotModified()
+
+        except Exception as e:
+            # Keep entries from last successful refresh
+            print(
+                "[%s] Refreshing RSS feed for %s failed: %s"
+                % (self.getName(), feed['name'], e)
+            )
+            return False
+
+    async def __streamFeed(self, feed: dict) -> httpResponse:
+        """Download and parse feed until the first known entry"""
+        maxEntries = feed.get('max_entries', self._config['max_entries'])
+        maxSize = feed.get('max_size', self._config['max_size'])
+        previousEntries = self.__rss.get(feed['id'])
+
+        parser = app.feedParser.feedStreamParser(
+            seen=frozenset(
+                (entry.guid, entry.updated) for entry in previousEntries or []
+            ),
+            limit=maxEntries,
+            maxSize=maxSize
+        )
+
+        async def consume(chunk: bytes) -> bool:
+            # Parse in thread pool while downloading
+            return await executor().runBlocking(parser.feed, chunk)
+
+        response = await self._stream(
+            feed['url'],
+            consume,
+            conditional=(previousEntries is not None),
+            key=feed['id']
+        )
+
+        if response.isModified():
+            if parser.isTruncated():
+                print(
+                    "[%s] RSS feed for %s is larger than %d bytes, "
+                    "using only its first entries"
+                    % (self.getName(), feed['name'], maxSize)
+                )
+
+            # Keep known entries after new entries
+            entries = await executor().runBlocking(parser.close)
+            guids = {entry.guid for entry in entries}
+            entries += [
+                entry
+                for entry in previousEntries or []
+                if entry.guid not in guids
+            ]
+            self.__rss[feed['id']] = entries[0:maxEntries]
+            self._saveValidators(response, feed['id'])
+
+        return response
 
-    def __formatOutput(self, feed: dict, entry: dict,
+    def __formatOutput(self, feed: dict, entry: app.feedParser.feedEntry,
                        summarize: bool = False) -> str:
         """Format RSS entry"""
 
@@ -297,14 +580,14 @@ class rss(app.plugin.plugin):
                     entry.title.split(" - ", 1)[0]
                 )
             if len(entry.title.split(" - ", 1)) == 2:
-                message += " (comment: %s)" % entry.title.split(" - ", 1)[1]
+                message += \
+                    " (comment: %s)" % entry.title.split(" - ", 1)[1]
             message2 = "%s" % entry.link.split("?", 1)[0]
         # Format Wordpress
         elif feed['type'] == 'wordpress':
             message = "%s added %s" % (entry.author, entry.title)
             message2 = "%s" % entry.link.split("?", 1)[0]
         else:
-            print(entry)
             message = "%s: %s" % (entry.author, entry.title)
             message2 = "%s" % entry.link
 
@@ -1,5 +1,3 @@
-import aiocron
-import aiohttp
 import asyncio
 import datetime
 import json
@@ -50,11 +48,14 @@ class status(app.plugin.plugin):
         # Set available rooms from config
         self._keywords['status']['rooms'] = self._getRooms('status')
 
-        # Get status once
-        for statusConfig in self._config['status']:
-            asyncio.get_event_loop().run_until_complete(
+    async def startup(self):
+        """Get status once"""
+        await asyncio.gather(
+            *[
                 self.__getStatus(statusConfig)
-            )
+                for statusConfig in self._config['status']
+            ]
+        )
 
     async def __getStatus(self, statusConfig: dict):
         """Refresh status if older than cache time"""
@@ -70,26 +71,35 @@ class status(app.plugin.plugin):
             pass
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(statusConfig['url']) as response:
-                    print(
-                        "[%s] Refreshing status for %s from %s"
-                        % (
-                            self.getName(),
-                            statusConfig['id'],
-                            statusConfig['url']
-                        )
-                    )
-                    if response.status == 200:
-                        self.__status[statusConfig['id']] = \
-                            json.loads(await response.text())
-                        self.__statusUpdate[statusConfig['id']] = \
-                            datetime.datetime.now()
-                    else:
-                        print(
-                            "[%s] Error downloading status. HTTP status: %d"
-                            % (self.getName(), response.status)
-                        )
+            print(
+                "[%s] Refreshing status for %s from %s"
+                % (
+                    self.getName(),
+                    statusConfig['id'],
+                    statusConfig['url']
+                )
+            )
+            response = await self._fetch(
+                statusConfig['url'],
+                conditional=(
+                    self.__status.get(statusConfig['id']) is not None
+                ),
+                key=statusConfig['id']
+            )
+            if response.isModified():
+                self.__status[statusConfig['id']] = json.loads(response.text)
+                self.__statusUpdate[statusConfig['id']] = \
+                    datetime.datetime.now()
+                self._saveValidators(response, statusConfig['id'])
+            elif response.isNotModified():
+                # Keep current status
+                self.__statusUpdate[statusConfig['id']] = \
+                    datetime.datetime.now()
+            else:
+                print(
+                    "[%s] Error downloading status. HTTP status: %d"
+                    % (self.getName(), response.status)
+                )
 
         except Exception as e:
             # Something went wrong, remove saved status
@@ -0,0 +1,202 @@
+import asyncio
+import cronsim
+import datetime
+import random
+import time
+import traceback
+
+
+class scheduler:
+    """
+    Central scheduler for periodic jobs of all plugins
+
+    Each job runs in its own task, so a run never overlaps the previous
+    one. Runs are spread by jitter and failing jobs are delayed by an
+    exponential backoff.
+    """
+
+    # Singleton instance
+    __instance = None
+
+    # Registered jobs by name
+    __jobs = {}
+
+    # Scheduler started
+    __started = False
+
+    # Backoff for failing jobs in seconds
+    __backoffBase = 60
+    __backoffMax = 3600
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(scheduler, singletonClass).__new__(singletonClass)
+        return singletonClass.__instance
+
+    def addJob(
+            self, name: str, func, cron: str = None, interval: float = None,
+            jitter: float = 0, args: tuple = (), ready=None):
+        """Register periodic job
+
+        Parameters
+        ----------
+        name : str
+            Unique job name
+        func : coroutine function
+            Function to run
+        cron : str
+            Crontab specification for run times
+        interval : float
+            Seconds between runs if no cron specification is given,
+            the first run is delayed randomly within the interval
+        jitter : float
+            Maximum random delay in seconds added to each run
+        args : tuple
+            Arguments for function
+        ready : function
+            Returns if the job may run yet, runs are skipped until it
+            does (e.g. while the plugin of the job is starting)
+        """
+        if (cron is None) == (interval is None):
+            raise ValueError("Job needs either cron or interval")
+
+        self.__jobs[name] = {
+            'name': name,
+            'func': func,
+            'args': args,
+            'ready': ready,
+            'cron': cron,
+            'interval': interval,
+            'jitter': jitter,
+            'slot': None,
+            'lastRun': None,
+            'duration': None,
+            'nextRun': None,
+            'failures': 0,
+            'task': None,
+        }
+
+        if self.__started:
+            self.__startJob(self.__jobs[name])
+
+    def start(self):
+        """Start all registered jobs"""
+        self.__started = True
+        for job in self.__jobs.values():
+            self.__startJob(job)
+
+    def __startJob(self, job: dict):
+        """Start task for job"""
+        job['task'] = asyncio.get_event_loop().create_task(self.__run(job))
+
+    def __getNextRun(self, job: dict) -> float:
+        """Get timestamp of next run"""
+        now = time.time()
+
+        if job['cron'] is not None:
+            # Never use a cron slot twice, even if woken up early
+            job['slot'] = next(
+                cronsim.CronSim(
+                    job['cron'],
+                    datetime.datetime.fromtimestamp(
+                        max(now, job['slot'] or 0)
+                    ).astimezone()
+                )
+            ).timestamp()
+            nextRun = job['slot']
+        elif job['lastRun'] is None:
+            # Spread first run of interval jobs
+            nextRun = now + random.uniform(0, job['interval'])
+        else:
+            nextRun = job['lastRun'] + job['interval']
+
+        nextRun += random.uniform(0, job['jitter'])
+
+        # Delay failing jobs
+        if job['failures'] > 0:
+            nextRun = max(
+                nextRun,
+                now + min(
+                    self.__backoffBase * 2 ** (job['failures'] - 1),
+                    self.__backoffMax
+                )
+            )
+
+        return max(nextRun, now)
+
+    async def __run(self, job: dict):
+        """Run job periodically"""
+        while True:
+            job['nextRun'] = self.__getNextRun(job)
+            await asyncio.sleep(job['nextRun'] - time.time())
+
+            # Never overlap startup, which refreshes the same data
+            if job['ready'] is not None and not job['ready']():
+                continue
+
+            job['lastRun'] = time.time()
+            try:
+                await job['func'](*job['args'])
+                job['failures'] = 0
+            except Exception:
+                job['failures'] += 1
+                print(
+                    "Job %s failed (%d times):\n%s"
+                    % (job['name'], job['failures'], traceback.format_exc())
+                )
+            job['duration'] = time.time() - job['lastRun']
+
+    def getJobs(self) -> list:
+        """Get status of all jobs
+
+        Returns
+        -------
+        list
+            Dictionaries with name, last run, duration, next run and
+            number of failures
+        """
+        return [
+            {
+                'name': job['name'],
+                'lastRun': job['lastRun'],
+                'duration': job['duration'],
+                'nextRun': job['nextRun'],
+                'failures': job['failures'],
+            }
+            for job in sorted(self.__jobs.values(), key=lambda j: j['name'])
+        ]
+
+    def report(self) -> str:
+        """Format status of all jobs"""
+        def formatTime(timestamp):
+            if timestamp is None:
+                return '-'
+            return datetime.datetime.fromtimestamp(timestamp).strftime(
+                '%d.%m. %H:%M:%S'
+            )
+
+        jobs = self.getJobs()
+        if len(jobs) == 0:
+            return "No jobs scheduled."
+
+        nameMaxLength = max(3, max(len(job['name']) for job in jobs))
+
+        output = "%s | %s | %s | %s | FAILURES" % (
+            'JOB'.ljust(nameMaxLength),
+            'LAST RUN'.ljust(15),
+            'DURATION',
+            'NEXT RUN'.ljust(15)
+        )
+        for job in jobs:
+            output += "\n%s | %s | %s | %s | %d" % (
+                job['name'].ljust(nameMaxLength),
+                formatTime(job['lastRun']).ljust(15),
+                ('-' if job['duration'] is None
+                 else '%.2fs' % job['duration']).rjust(8),
+                formatTime(job['nextRun']).ljust(15),
+                job['failures']
+            )
+
+        return output
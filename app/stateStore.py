@@ -0,0 +1,117 @@
+import asyncio
+import json
+import os
+import safer
+
+from app.config import config
+from app.executor import executor
+
+
+class stateStore:
+    """
+    Persistent store for runtime state (e.g. announcement cursors)
+
+    State is kept in memory and written debounced to one json file per
+    namespace. Files are written atomically outside of the event loop.
+    """
+
+    # Singleton instance
+    __instance = None
+
+    # Default config
+    __configDefault = {
+        'directory': 'config/cache/state',
+        'flush_delay': 5,
+    }
+
+    def __new__(singletonClass):
+        """Instantiate singleton class"""
+        if singletonClass.__instance is None:
+            singletonClass.__instance = \
+                super(stateStore, singletonClass).__new__(singletonClass)
+            singletonClass.__instance.__initialize()
+        return singletonClass.__instance
+
+    def __initialize(self):
+        """Initialize store state"""
+        self.__config = {
+            **self.__configDefault,
+            **config().getStateConfig()
+        }
+        self.__state = {}
+        self.__dirty = set()
+        self.__flushHandle = None
+        self.__flushTask = None
+        self.__flushLock = asyncio.Lock()
+
+    def __getFilename(self, namespace: str) -> str:
+        """Get filename for namespace"""
+        return os.path.join(self.__config['directory'], '%s.json' % namespace)
+
+    def __load(self, namespace: str) -> dict:
+        """Load namespace from file on first access"""
+        if namespace not in self.__state:
+            try:
+                with open(self.__getFilename(namespace), 'r') as f:
+                    self.__state[namespace] = json.load(f)
+            except (OSError, ValueError):
+                self.__state[namespace] = {}
+        return self.__state[namespace]
+
+    def get(self, namespace: str, key: str, default=None):
+        """Get value from namespace"""
+        return self.__load(namespace).get(key, default)
+
+    def set(self, namespace: str, key: str, value):
+        """Set value in namespace and schedule debounced write"""
+        self.__load(namespace)[key] = value
+        self.__dirty.add(namespace)
+
+        if self.__flushHandle is None:
+            self.__flushHandle = asyncio.get_event_loop().call_later(
+                self.__config['flush_delay'], self.__startFlush
+            )
+
+    def __startFlush(self):
+        """Start debounced write, keep task until it is done"""
+        self.__flushTask = asyncio.get_event_loop().create_task(self.flush())
+        self.__flushTask.add_done_callback(self.__flushDone)
+
+    def __flushDone(self, task: asyncio.Task):
+        """Log exception of debounced write"""
+        self.__flushTask = None
+        if not task.cancelled() and task.exception() is not None:
+            print("Writing state failed: %s" % task.exception())
+
+    async def flush(self):
+        """Write all changed namespaces"""
+        if self.__flushHandle is not None:
+            self.__flushHandle.cancel()
+            self.__flushHandle = None
+
+        async with self.__flushLock:
+            # Serialize in event loop, write in executor
+            files = {
+                self.__getFilename(namespace):
+                    json.dumps(self.__state[namespace], indent=4)
+                for namespace in self.__dirty
+            }
+            namespaces = self.__dirty
+            self.__dirty = set()
+
+            if len(files) == 0:
+                return
+
+            try:
+                await executor().runBlocking(self.__write, files)
+            except OSError as e:
+                # Keep namespaces dirty to retry on next write
+                print("Writing state failed: %s" % e)
+                self.__dirty |= namespaces
+
+    def __write(self, files: dict):
+        """Write serialized namespaces to files atomically"""
+        os.makedirs(self.__config['directory'], exist_ok=True)
+        for filename, data in files.items():
+            with safer.open(filename, 'w') as f:
+                f.write(data)
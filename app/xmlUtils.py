@@ -0,0 +1,10 @@
+"""
+XML helpers
+
+Shared by the parsers reading feeds and calendars with ElementTree.
+"""
+
+
+def getLocalName(tag: str) -> str:
+    """ Get tag name without namespace """
+    return tag.rsplit('}', 1)[-1]